@@ -42,7 +42,8 @@ class AppDynamicsAgent(BaseWatcher):
         Update our log targets, and pick relevant log fields from ``target['kwargs']``
         """
         log = {}
-        log['kwargs'] = target['kwargs']
+        # Kept until the container is removed, pod annotations are not used by the job template.
+        log['kwargs'] = {k: v for k, v in target['kwargs'].items() if k != 'pod_annotations'}
         pod_labels = target['pod_labels']
         container_id = target['id']
 
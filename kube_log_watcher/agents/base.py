@@ -8,6 +8,9 @@ class BaseWatcher:
     BaseWatcher implementing a contextmanager.
     """
 
+    # Watcher configuration keys applied by ``reconfigure``. Changing any other key creates new agents.
+    live_config_keys = frozenset()
+
     def __init__(self, configuration):
         pass
 
@@ -25,6 +28,13 @@ class BaseWatcher:
     def __exit__(self, *exc):
         self.flush()
 
+    def reconfigure(self, configuration):
+        """
+        Apply changed watcher ``configuration`` to a running agent. Called only if all changed keys are in
+        ``live_config_keys`` of every agent, so existing log targets are kept.
+        """
+        pass
+
     def add_log_target(self, target: dict):
         raise NotImplementedError()
 
@@ -2,15 +2,21 @@
 Scalyr watcher agent for providing config file and variables required to ship logs to Scalyr.
 """
 import binascii
-import json
+import concurrent.futures
+import functools
+import hashlib
 import logging
 import os
 import shutil
+import sys
+from urllib.parse import quote_plus
 
+from kube_log_watcher import jsonutils
 from kube_log_watcher.agents.base import BaseWatcher
 from kube_log_watcher.template_loader import load_template
 
 TPL_NAME = 'scalyr.json.jinja2'
+LOG_TPL_NAME = 'scalyr-log.json.jinja2'
 
 SCALYR_CONFIG_PATH = '/etc/scalyr-agent-2/agent.json'
 
@@ -22,30 +28,89 @@ SCALYR_ANNOTATION_PARSER = 'kubernetes-log-watcher/scalyr-parser'
 SCALYR_ANNOTATION_SAMPLING_RULES = 'kubernetes-log-watcher/scalyr-sampling-rules'
 # '[{"container": "my-container", "redaction-rules":[{ "match_expression": "<expression here>" }]}]'
 SCALYR_ANNOTATION_REDACTION_RULES = 'kubernetes-log-watcher/scalyr-redaction-rules'
+# Shared by all log targets and appended by reference, never mutate!
 JWT_REDACTION_RULE = {
     "match_expression": "eyJ[a-zA-Z0-9/+_=-]{5,}\\.eyJ[a-zA-Z0-9/+_=-]{5,}\\.[a-zA-Z0-9/+_=-]{5,}",
     "replacement": "+++JWT_TOKEN_REDACTED+++"
 }
 SCALYR_DEFAULT_PARSER = 'json'
+# Static Scalyr agent settings
+SCALYR_AGENT_SETTINGS = {
+    'max_log_offset_size': 536870912,
+    'max_existing_log_offset_size': 536870912,
+    'max_allowed_request_size': 5500000,
+    'min_request_spacing_interval': 0.5,
+    'max_request_spacing_interval': 1.0,
+    'pipeline_threshold': 0.1,
+    'compression_type': 'deflate',
+    'compression_level': 6,
+    'max_line_size': 49900,
+    'read_page_size': 131072,
+    'implicit_metric_monitor': False,
+    'implicit_agent_process_metrics_monitor': False,
+    'include_raw_timestamp_field': False,
+}
 SCALYR_DEFAULT_WRITE_RATE = 10000
 SCALYR_DEFAULT_WRITE_BURST = 200000
 
 logger = logging.getLogger(__name__)
 
 
+def _is_list_or_warn(value, annotation, scope, *names) -> bool:
+    """
+    Return True if ``value`` is a list. Otherwise warn about the invalid ``annotation`` of ``names`` in ``scope`` (e.g.
+    ``pod/container``) and return False.
+    """
+    if isinstance(value, list):
+        return True
+
+    logger.warning('Scalyr watcher agent found invalid %s annotation in %s: %s. Expected `list` found: `%s`',
+                   annotation, scope, '/'.join(names), type(value))
+    return False
+
+
+def _intern(value):
+    """
+    Intern ``value`` if it is a non-empty string. Attribute values like application or namespace repeat across many
+    containers, so every log target can share a single copy.
+    """
+    if value and isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_annotation(raw: str) -> tuple:
+    """
+    Decode annotation JSON value and index its entries by container name. Containers of the same pod share the same
+    annotation strings, so decoded values are cached. Returned values are shared between callers and must not be
+    mutated!
+
+    :return: Decoded value and ``{container_name: candidate}`` lookup (empty if decoded value is not a list).
+    :rtype: tuple
+    """
+    result_candidates = jsonutils.loads(raw)
+
+    candidates_by_container = {}
+    if isinstance(result_candidates, list):
+        for candidate in result_candidates:
+            if isinstance(candidate, dict):
+                # First entry for a container wins.
+                candidates_by_container.setdefault(candidate.get('container'), candidate)
+
+    return result_candidates, candidates_by_container
+
+
 def container_annotation(annotations, container_name, pod_name, annotation_key, result_key, default=None):
     if annotations and annotation_key in annotations:
         try:
-            result_candidates = json.loads(annotations[annotation_key])
-            if type(result_candidates) is not list:
-                logger.warning(
-                    'Scalyr watcher agent found invalid %s annotation in pod: %s. Expected `list` found: `%s`',
-                    annotation_key, pod_name, type(result_candidates))
-            else:
-                for candidate in result_candidates:
-                    if candidate.get('container') == container_name:
-                        return candidate.get(result_key, default)
-        except json.JSONDecodeError:
+            result_candidates, candidates_by_container = _decode_annotation(annotations[annotation_key])
+            if (
+                _is_list_or_warn(result_candidates, annotation_key, 'pod', pod_name)
+                and container_name in candidates_by_container
+            ):
+                return candidates_by_container[container_name].get(result_key, default)
+        except jsonutils.JSONDecodeError:
             logger.exception(
                 'Scalyr watcher agent failed to load annotation %s for container %s in pod %s',
                 annotation_key, container_name, pod_name)
@@ -78,12 +143,92 @@ def get_redaction_rules(annotations, kwargs):
                                  annotation_key=SCALYR_ANNOTATION_REDACTION_RULES,
                                  result_key='redaction-rules',
                                  default=[])
-    if type(rules) is not list:
-        logger.warning('Scalyr watcher agent found invalid redaction rule annotation in pod/container: %s/%s. '
-                       'Expected `list` found: `%s`', kwargs['pod_name'], kwargs['container_name'], type(rules))
+    if not _is_list_or_warn(rules, 'redaction rule', 'pod/container', kwargs['pod_name'], kwargs['container_name']):
         rules = []
-    rules.append(JWT_REDACTION_RULE)
-    return rules
+
+    # Scalyr applies every rule to every log line, do not add the JWT rule twice.
+    jwt_expression = JWT_REDACTION_RULE['match_expression']
+    if any(isinstance(rule, dict) and rule.get('match_expression') == jwt_expression for rule in rules):
+        return rules
+
+    return [*rules, JWT_REDACTION_RULE]
+
+
+class LogEntry:
+    """Scalyr log target kept by ``ScalyrAgent`` for every watched container."""
+
+    __slots__ = ('path', 'attributes', 'sampling_rules', 'redaction_rules', 'parse_lines_as_json')
+
+    def __init__(self, path: str, attributes: dict, sampling_rules: list = None, redaction_rules: list = None,
+                 parse_lines_as_json: bool = False):
+        self.path = path
+        self.attributes = attributes
+        self.sampling_rules = sampling_rules
+        self.redaction_rules = redaction_rules
+        self.parse_lines_as_json = parse_lines_as_json
+
+
+def build_log_config(log: LogEntry) -> dict:
+    """Return Scalyr ``logs`` entry for a log target."""
+    attributes = log.attributes
+    config = {
+        'path': log.path,
+        'rename_logfile': '?application={}&component={}&version={}&container_id={}'.format(
+            quote_plus(attributes.get('application') or ''),
+            quote_plus(attributes.get('component') or ''),
+            quote_plus(attributes.get('version') or ''),
+            quote_plus(attributes.get('container_id') or ''),
+        ),
+    }
+
+    if log.sampling_rules:
+        config['sampling_rules'] = log.sampling_rules
+    if log.redaction_rules:
+        config['redaction_rules'] = log.redaction_rules
+    if log.parse_lines_as_json:
+        config['parse_lines_as_json'] = True
+
+    config['copy_from_start'] = True
+    config['attributes'] = attributes
+
+    return config
+
+
+def build_agent_config(api_key, server_attributes, journald=None, scalyr_server=None, enable_profiling=False) -> dict:
+    """Return Scalyr agent config without ``logs``, see ``dump_agent_config``."""
+    config = {'api_key': api_key, **SCALYR_AGENT_SETTINGS, 'server_attributes': server_attributes}
+
+    if enable_profiling:
+        config['enable_profiling'] = True
+    if scalyr_server:
+        config['scalyr_server'] = scalyr_server
+
+    config['monitors'] = []
+    config['journald_logs'] = []
+    if journald:
+        monitor = {}
+        if journald.get('journal_path'):
+            monitor['journal_path'] = str(journald['journal_path'])
+        # journal_fields (``extra_fields``) are not set, they are broken in scalyr agent.
+        monitor['module'] = 'scalyr_agent.builtin_monitors.journald_monitor'
+        monitor['monitor_log_write_rate'] = journald['write_rate']
+        monitor['monitor_log_max_write_burst'] = journald['write_burst']
+        config['monitors'].append(monitor)
+
+        journald_log = {}
+        if journald.get('attributes'):
+            journald_log['attributes'] = {k: str(v) for k, v in journald['attributes'].items()}
+        journald_log['journald_unit'] = '.*'
+        journald_log['parser'] = 'journald_monitor'
+        config['journald_logs'].append(journald_log)
+
+    return config
+
+
+def dump_agent_config(config: dict, log_fragments) -> str:
+    """Serialize agent ``config`` with already serialized ``log_fragments`` (``logs`` entries) spliced in."""
+    head = jsonutils.dumps(config)
+    return '{},"logs":[{}]}}'.format(head[:-1], ','.join(log_fragments))
 
 
 class ScalyrAgent(BaseWatcher):
@@ -94,11 +239,14 @@ class ScalyrAgent(BaseWatcher):
         )
         self.api_key_file = os.environ.get('WATCHER_SCALYR_API_KEY_FILE')
         self.api_key = None
+        self._api_key_file_stat = None
         self.dest_path = os.environ.get('WATCHER_SCALYR_DEST_PATH')
         self.scalyr_server = os.environ.get('WATCHER_SCALYR_SERVER')
         self.json_parsers_mapping = self.make_json_parsers_mapping(
             os.environ.get('WATCHER_SCALYR_PARSE_LINES_JSON', ''),
         )
+        self._resolve_json_parser = self.json_parsers_mapping.get
+        self._wildcard_json_parser = self.json_parsers_mapping.get('*')
         self.enable_profiling = os.environ.get('WATCHER_SCALYR_ENABLE_PROFILING', '').lower() == 'true'
         cluster_alias = os.environ.get('CLUSTER_ALIAS', 'none')
         cluster_environment = os.environ.get('CLUSTER_ENVIRONMENT', 'production')
@@ -125,9 +273,13 @@ class ScalyrAgent(BaseWatcher):
                 'Scalyr watcher agent initialization failed. {} destination path does not exist.'.format(
                     self.dest_path))
         else:
-            watched_containers = os.listdir(self.dest_path)
-            logger.info('Scalyr watcher agent found %d watched containers.', len(watched_containers))
-            logger.debug('Scalyr watcher agent found the following watched containers: %s', watched_containers)
+            with os.scandir(self.dest_path) as entries:
+                watched_count = sum(1 for _ in entries)
+            logger.info('Scalyr watcher agent found %d watched containers.', watched_count)
+            if logger.isEnabledFor(logging.DEBUG):
+                with os.scandir(self.dest_path) as entries:
+                    logger.debug('Scalyr watcher agent found the following watched containers: %s',
+                                 [entry.name for entry in entries])
 
         self.journald = None
         journald_monitor = os.environ.get('WATCHER_SCALYR_JOURNALD', False)
@@ -137,8 +289,8 @@ class ScalyrAgent(BaseWatcher):
             extra_fields_str = os.environ.get('WATCHER_SCALYR_JOURNALD_EXTRA_FIELDS', '{}')
             self.journald = {
                 'journal_path': os.environ.get('WATCHER_SCALYR_JOURNALD_PATH'),
-                'attributes': json.loads(attributes_str),
-                'extra_fields': json.loads(extra_fields_str),
+                'attributes': jsonutils.loads(attributes_str),
+                'extra_fields': jsonutils.loads(extra_fields_str),
                 'write_rate': int(os.environ.get('WATCHER_SCALYR_JOURNALD_WRITE_RATE', SCALYR_DEFAULT_WRITE_RATE)),
                 'write_burst': int(os.environ.get('WATCHER_SCALYR_JOURNALD_WRITE_BURST', SCALYR_DEFAULT_WRITE_BURST)),
             }
@@ -152,9 +304,24 @@ class ScalyrAgent(BaseWatcher):
             'node': node_name,
             'parser': SCALYR_DEFAULT_PARSER
         }
+        self._server_attributes_items = frozenset(self.server_attributes.items())
 
-        self.tpl = load_template(TPL_NAME)
+        # Jinja templates render the same config, kept for comparison during rollout.
+        self.use_template = os.environ.get('WATCHER_SCALYR_USE_TEMPLATE', '').lower() == 'true'
+        if self.use_template:
+            self.tpl = load_template(TPL_NAME)
+            self.log_tpl = load_template(LOG_TPL_NAME)
         self.logs = {}
+        self._log_paths = set()
+        # Log paths in the config as last written.
+        self._written_log_paths = set()
+        self._log_fragments = {}
+        self._pending_removals = []
+        self._config_digest = None
+        # (st_ino, st_mtime_ns, st_size) of the config file as last written.
+        self._config_file_stat = None
+        # Log targets changed since the config was last written.
+        self._dirty = True
         self._first_run = True
 
         logger.info('Scalyr watcher agent initialization complete!')
@@ -168,7 +335,7 @@ class ScalyrAgent(BaseWatcher):
                 if ('probability' in scalyr_sampling_rule) and not (0 <= scalyr_sampling_rule['probability'] <= 1):
                     raise ValueError('`probability` must be between 0 and 1')
 
-                json.loads(scalyr_sampling_rule['value'])
+                jsonutils.loads(scalyr_sampling_rule['value'])
             except (TypeError, KeyError, ValueError) as error:
                 logger.warning('Cannot parse rule `%s`: %s', scalyr_sampling_rule, repr(error))
             else:
@@ -200,6 +367,8 @@ class ScalyrAgent(BaseWatcher):
         return self._first_run
 
     def get_scalyr_sampling_rule(self, container_data):
+        container_sample = None
+
         for scalyr_sampling_rule in self.scalyr_sampling_rules:
             if (
                 ('application' in scalyr_sampling_rule)
@@ -214,8 +383,9 @@ class ScalyrAgent(BaseWatcher):
                 continue
 
             if 'probability' in scalyr_sampling_rule:
-                container_crc = binascii.crc32(container_data['container_id'].encode())
-                if ((container_crc % 100) + 1) > scalyr_sampling_rule['probability'] * 100:
+                if container_sample is None:
+                    container_sample = (binascii.crc32(container_data['container_id'].encode()) % 100) + 1
+                if container_sample > scalyr_sampling_rule['probability'] * 100:
                     continue
 
             return scalyr_sampling_rule['value']
@@ -234,69 +404,73 @@ class ScalyrAgent(BaseWatcher):
         annotations = kwargs.get('pod_annotations', {})
 
         parser = get_parser(annotations, kwargs)
-        if parser in self.json_parsers_mapping:
-            parse_lines_as_json = True
-            parser = self.json_parsers_mapping[parser]
-        elif '*' in self.json_parsers_mapping:
+        json_parser = self._resolve_json_parser(parser)
+        if json_parser is not None:
             parse_lines_as_json = True
+            parser = json_parser
         else:
-            parse_lines_as_json = False
+            parse_lines_as_json = self._wildcard_json_parser is not None
 
         attributes = {
-            'application': kwargs['application'],
-            'component': kwargs['component'],
-            'environment': kwargs['environment'],
-            'version': kwargs['version'],
-            'release': kwargs['release'],
+            'application': _intern(kwargs['application']),
+            'component': _intern(kwargs['component']),
+            'environment': _intern(kwargs['environment']),
+            'version': _intern(kwargs['version']),
+            'release': _intern(kwargs['release']),
             'pod': kwargs['pod_name'],
-            'namespace': kwargs['namespace'],
-            'container': kwargs['container_name'],
+            'namespace': _intern(kwargs['namespace']),
+            'container': _intern(kwargs['container_name']),
             'container_id': kwargs['container_id'],
-            'parser': parser,
+            'parser': _intern(parser),
         }
 
         # Keep only attributes that has value not duplicated in server_attributes
         attributes = {
             k: v
             for k, v in attributes.items()
-            if v and (self.server_attributes.get(k) != v)
+            if v and ((k, v) not in self._server_attributes_items)
         }
 
         sampling_rules = self.get_scalyr_sampling_rule(kwargs)
         if sampling_rules is not None:
             logger.warning('Overwriting container %s (%s/%s) sampling annotation',
                            kwargs['container_id'], kwargs['application'], kwargs['component'])
-            annotations[SCALYR_ANNOTATION_SAMPLING_RULES] = sampling_rules
-
-        log = {
-            'path': log_path,
-            'sampling_rules': get_sampling_rules(annotations, kwargs),
-            'redaction_rules': get_redaction_rules(annotations, kwargs),
-            'attributes': attributes,
-            'parse_lines_as_json': parse_lines_as_json,
-        }
+            # Pod annotations are shared by all containers of the pod, never mutate them!
+            annotations = {**annotations, SCALYR_ANNOTATION_SAMPLING_RULES: sampling_rules}
+
+        log = LogEntry(
+            log_path,
+            attributes,
+            sampling_rules=get_sampling_rules(annotations, kwargs),
+            redaction_rules=get_redaction_rules(annotations, kwargs),
+            parse_lines_as_json=parse_lines_as_json,
+        )
 
         self.logs[target['id']] = log
+        self._log_paths.add(log_path)
+        # Render each log target once, flush only joins the rendered fragments.
+        self._log_fragments[target['id']] = self._render_log(log)
+        self._dirty = True
 
     def remove_log_target(self, container_id: str):
         container_dir = os.path.join(self.dest_path, container_id)
 
-        try:
-            del self.logs[container_id]
-        except KeyError:
+        self._log_fragments.pop(container_id, None)
+
+        log = self.logs.pop(container_id, None)
+        if log is None:
             logger.warning('Failed to remove log target: %s', container_id)
+        else:
+            self._log_paths.discard(log.path)
+            self._dirty = True
 
-        try:
-            shutil.rmtree(container_dir)
-        except OSError:
-            logger.warning('Scalyr watcher agent failed to remove container directory %s', container_dir)
+        # Removed on flush, together with other stale containers.
+        self._pending_removals.append(container_dir)
 
     def flush(self):
-        current_paths = self._get_current_log_paths()
-        new_paths = {log['path'] for log in self.logs.values()}
+        self._remove_container_dirs()
 
-        with open(self.api_key_file) as f:
-            new_api_key = f.read()
+        new_api_key = self._read_api_key()
 
         new_key = (self.api_key != new_api_key)
         if new_key:
@@ -304,32 +478,146 @@ class ScalyrAgent(BaseWatcher):
             if not self._first_run:
                 logger.info('Scalyr API key updated')
 
-        if self._first_run or new_key or (new_paths ^ current_paths):
+        config_file_stat = self._stat_config_file()
+
+        if not (self._first_run or self._dirty or new_key):
+            if config_file_stat == self._config_file_stat:
+                # Idle sync, the config written last time is still current.
+                return
+            logger.warning('Scalyr watcher agent config file %s was modified or removed, restoring it.',
+                           self.config_path)
+
+        try:
+            config = self._render_config().encode()
+        except Exception:
+            logger.exception('Scalyr watcher agent failed to render config file.')
+            return
+
+        config_digest = hashlib.blake2b(config).hexdigest()
+        if (
+            not self._first_run
+            and config_digest == self._config_digest
+            and config_file_stat == self._config_file_stat
+        ):
+            # Nothing changed since the config was last written.
+            self._dirty = False
+            return
+
+        current_paths = self._written_log_paths
+        new_paths = self._log_paths
+
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Scalyr watcher agent new paths: %s', new_paths)
             logger.debug('Scalyr watcher agent current paths: %s', current_paths)
-            try:
-                config = self.tpl.render(
-                    scalyr_key=self.api_key,
-                    server_attributes=self.server_attributes,
-                    logs=self.logs.values(),
-                    monitor_journald=self.journald,
-                    scalyr_server=self.scalyr_server,
-                    enable_profiling=self.enable_profiling,
-                )
-
-                with open(self.config_path, 'w') as fp:
-                    fp.write(config)
-            except Exception:
-                logger.exception('Scalyr watcher agent failed to write config file.')
-            else:
-                self._first_run = False
+
+        try:
+            written = self._write_config(config)
+        except Exception:
+            logger.exception('Scalyr watcher agent failed to write config file.')
+        else:
+            self._first_run = False
+            self._dirty = False
+            self._config_digest = config_digest
+            self._config_file_stat = self._stat_config_file()
+            self._written_log_paths = set(new_paths)
+            if written:
                 logger.info('Scalyr watcher agent updated config file %s with +%s -%s log targets.',
                             self.config_path,
                             len(new_paths - current_paths),
                             len(current_paths - new_paths)
                             )
+            else:
+                logger.debug('Scalyr watcher agent config file %s is up to date.', self.config_path)
+
+    def _render_log(self, log) -> str:
+        if self.use_template:
+            return self.log_tpl.render(log=log)
+
+        return jsonutils.dumps(build_log_config(log))
+
+    def _render_config(self) -> str:
+        if self.use_template:
+            return self.tpl.render(
+                scalyr_key=self.api_key,
+                server_attributes=self.server_attributes,
+                log_fragments=self._log_fragments.values(),
+                monitor_journald=self.journald,
+                scalyr_server=self.scalyr_server,
+                enable_profiling=self.enable_profiling,
+            )
+
+        config = build_agent_config(
+            self.api_key,
+            self.server_attributes,
+            journald=self.journald,
+            scalyr_server=self.scalyr_server,
+            enable_profiling=self.enable_profiling,
+        )
+        return dump_agent_config(config, self._log_fragments.values())
+
+    def _read_api_key(self) -> str:
+        """Return API key from key file. The file is only read again if it was modified (e.g. secret rotation)."""
+        st = os.stat(self.api_key_file)
+        file_stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self.api_key is not None and file_stat == self._api_key_file_stat:
+            return self.api_key
+
+        with open(self.api_key_file) as f:
+            api_key = f.read()
+        self._api_key_file_stat = file_stat
+
+        return api_key
+
+    def _stat_config_file(self):
+        try:
+            st = os.stat(self.config_path)
+        except OSError:
+            return None
+
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _write_config(self, config: bytes) -> bool:
+        """
+        Write config file unless it already has the exact same content. Config is staged in a temporary file and
+        renamed, so the Scalyr agent never reads a partially written config. Return True if written.
+        """
+        try:
+            if os.stat(self.config_path).st_size == len(config):
+                with open(self.config_path, 'rb') as fp:
+                    if fp.read() == config:
+                        return False
+        except OSError:
+            pass
+
+        tmp_path = '{}.tmp'.format(self.config_path)
+        with open(tmp_path, 'wb') as fp:
+            fp.write(config)
+        os.replace(tmp_path, self.config_path)
+
+        return True
+
+    def _remove_container_dirs(self):
+        container_dirs, self._pending_removals = self._pending_removals, []
+        if not container_dirs:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(container_dirs))) as executor:
+            # Consume results, so unexpected errors are raised as by a serial loop.
+            for _ in executor.map(self._remove_container_dir, container_dirs):
+                pass
+
+    @staticmethod
+    def _remove_container_dir(container_dir):
+        try:
+            shutil.rmtree(container_dir)
+        except OSError:
+            logger.warning('Scalyr watcher agent failed to remove container directory %s', container_dir)
 
     def _adjust_target_log_path(self, target):
+        if target['id'] in self.logs:
+            # Already adjusted!
+            return self.logs[target['id']].path
+
         try:
             src_log_path = target['kwargs'].get('log_file_path')
             application = target['kwargs'].get('application') or target['kwargs'].get('pod_name') or 'none'
@@ -343,31 +631,15 @@ class ScalyrAgent(BaseWatcher):
             parent = os.path.join(self.dest_path, container_id)
             dst_log_path = os.path.join(parent, dst_name)
 
-            if not os.path.exists(parent):
-                os.makedirs(parent)
+            os.makedirs(parent, exist_ok=True)
 
             # symlink to have our own friendly log file name!
-            if not os.path.exists(dst_log_path):
+            try:
                 os.symlink(src_log_path, dst_log_path)
+            except FileExistsError:
+                pass
 
             return dst_log_path
         except Exception:
             logger.exception('Scalyr watcher agent Failed to adjust log path.')
             return None
-
-    def _get_current_log_paths(self) -> set:
-        targets = set()
-
-        try:
-            if os.path.exists(self.config_path):
-                with open(self.config_path) as fp:
-                    config = json.load(fp)
-                    targets.update(log.get('path') for log in config.get('logs', []))
-                    logger.debug('Scalyr watcher agent loaded existing config %s: %d log targets exist!',
-                                 self.config_path, len(config.get('logs', [])))
-            else:
-                logger.warning('Scalyr watcher agent cannot find config file!')
-        except Exception:
-            logger.exception('Scalyr watcher agent failed to read config!')
-
-        return targets
@@ -0,0 +1,28 @@
+"""
+JSON helpers. Use ``orjson`` if installed, otherwise fall back to stdlib ``json``.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# orjson.JSONDecodeError is a subclass of json.JSONDecodeError.
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    """Deserialize ``data`` (str or bytes)."""
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Serialize ``obj`` to a compact JSON str."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+
+    return json.dumps(obj, separators=(',', ':'))
@@ -7,6 +7,7 @@ from urllib.parse import urljoin
 
 import pykube
 import requests
+from requests.adapters import HTTPAdapter
 
 import kube_log_watcher
 
@@ -14,11 +15,20 @@ DEFAULT_SERVICE_ACC = '/var/run/secrets/kubernetes.io/serviceaccount'
 DEFAULT_NAMESPACE = 'default'
 
 PODS_URL = 'api/v1/namespaces/{}/pods/{}'
+ALL_PODS_URL = 'api/v1/pods'
 
 PAUSE_CONTAINER_PREFIX = 'gcr.io/google_containers/pause-'
+# Pause image repositories, matched without image tag or digest.
+PAUSE_CONTAINER_REPOSITORIES = frozenset(('k8s.gcr.io/pause', 'registry.k8s.io/pause'))
 
 logger = logging.getLogger(__name__)
 
+# Kube API proxy session, kept for the process lifetime so connections are reused across watch intervals.
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_session.headers['User-Agent'] = 'kube-log-watcher/{}'.format(kube_log_watcher.__version__)
+
 
 class PodNotFound(Exception):
     pass
@@ -76,7 +86,7 @@ def get_pod(name, namespace=DEFAULT_NAMESPACE, kube_url=None) -> pykube.Pod:
     """
     try:
         if kube_url:
-            r = requests.get(urljoin(kube_url, PODS_URL.format(namespace, name)))
+            r = _session.get(urljoin(kube_url, PODS_URL.format(namespace, name)))
 
             r.raise_for_status()
 
@@ -90,6 +100,35 @@ def get_pod(name, namespace=DEFAULT_NAMESPACE, kube_url=None) -> pykube.Pod:
         raise PodNotFound('Cannot find pod: {}'.format(name))
 
 
+def get_pods(node_name, kube_url=None) -> list:
+    """
+    Return pods scheduled on node ``node_name`` in all namespaces.
+    If ``kube_url`` is not ``None`` then kubernetes service account config won't be used.
+
+    :param node_name: Node name to use in filtering.
+    :type node_name: str
+
+    :param kube_url: URL of a proxy to kubernetes cluster api. Default is ``None``.
+    :type kube_url: str
+
+    :return: List of pod objects.
+    :rtype: list
+    """
+    if kube_url:
+        params = {'fieldSelector': 'spec.nodeName={}'.format(node_name)}
+        r = _session.get(urljoin(kube_url, ALL_PODS_URL), params=params)
+
+        r.raise_for_status()
+
+        return r.json().get('items', [])
+
+    kube_client = get_client()
+    query = pykube.Pod.objects(api=kube_client, namespace=pykube.all).filter(
+        field_selector={'spec.nodeName': node_name})
+
+    return [pod.obj for pod in query]
+
+
 def is_pause_container(config: dict) -> bool:
     """
     Return True if the config belongs to kubernetes *Pause* containers.
@@ -100,4 +139,14 @@ def is_pause_container(config: dict) -> bool:
     :return: True if "Pause" container, False otherwise.
     :rtype: bool
     """
-    return config.get('Image', '').startswith(PAUSE_CONTAINER_PREFIX)
+    image = config.get('Image', '')
+    if image.startswith(PAUSE_CONTAINER_PREFIX):
+        return True
+
+    repository = image.partition('@')[0]
+    name, sep, tag = repository.rpartition(':')
+    if sep and '/' not in tag:
+        # Not a registry port
+        repository = name
+
+    return repository in PAUSE_CONTAINER_REPOSITORIES
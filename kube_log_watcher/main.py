@@ -1,5 +1,5 @@
 import argparse
-import json
+import concurrent.futures
 import logging
 import os
 import sys
@@ -7,16 +7,24 @@ import time
 import yaml
 import sentry_sdk
 
-from typing import Tuple
+try:
+    import inotify_simple
+except ImportError:  # pragma: no cover
+    inotify_simple = None
+
+from typing import Dict, Optional, Tuple
 
 import kube_log_watcher.kube as kube
 
+from kube_log_watcher import jsonutils
 from kube_log_watcher.agents import ScalyrAgent, AppDynamicsAgent, Symlinker
 
 
 CONTAINERS_PATH = '/mnt/containers/'
 DEST_PATH = '/mnt/jobs/'
 
+MAX_SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
 APP_LABEL = 'application'
 COMPONENT_LABEL = 'component'
 ENVIRONMENT_LABEL = 'environment'
@@ -31,25 +39,73 @@ BUILTIN_AGENTS = {
     'symlinker': Symlinker,
 }
 
+# Wait after a containers path event, so container files are written before the next scan.
+INOTIFY_READ_DELAY = 1.0
+
 # Set via kubernetes downward API.
 CLUSTER_NODE_NAME = os.environ.get('CLUSTER_NODE_NAME')
 CLUSTER_ENVIRONMENT = os.environ.get('CLUSTER_ENVIRONMENT', 'production')
 
+# Prefer libyaml C loader if available.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Watcher config parsed on last read, keyed by file path and stat.
+_config_cache: dict = {'key': None, 'data': {}}
+CONFIG_CACHE_SETTLE_NS = 1000000000
+
 logger = logging.getLogger(__name__)
 
 
-def get_container_label_value(config, label) -> str:
+def get_container_labels(config) -> dict:
     """
-    Get label value from container config. Usually those labels are namespaced in the form:
+    Get container config labels with ``KUBERNETES_PREFIX`` stripped from label names. Usually those labels are
+    namespaced in the form:
         io.kubernetes.container.name
         io.kubernetes.pod.name
     """
-    labels = config['Config']['Labels']
-    for i, val in labels.items():
-        if i.endswith(label):
-            return val
+    labels: Dict[str, str] = {}
+    prefix_len = len(KUBERNETES_PREFIX)
+
+    for name, val in config['Config']['Labels'].items():
+        if name.startswith(KUBERNETES_PREFIX):
+            name = name[prefix_len:]
+        labels.setdefault(name, val)
 
-    return None
+    return labels
+
+
+def _load_container(entry: os.DirEntry) -> Optional[dict]:
+    """
+    Load container config from container dir ``entry``. Return ``None`` if the container has no log file or valid
+    config.
+    """
+    container_id = entry.name
+
+    # Assuming same path is mounted on node *logging agent* container.
+    source_log_file = os.path.join(entry.path, f'{container_id}-json.log')
+    if not os.path.exists(source_log_file):
+        return None
+
+    try:
+        with open(os.path.join(entry.path, 'config.v2.json'), 'rb') as fp:
+            config = jsonutils.loads(fp.read())
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception('Failed while retrieving config for container(%s)', container_id)
+        return None
+
+    if not config:
+        return None
+
+    # All is good and ready!
+    logger.debug('Successfully collected config for container(%s): %s', container_id, config)
+
+    return {
+        'id': container_id,
+        'config': config,
+        'log_file': source_log_file
+    }
 
 
 def get_containers(containers_path: str) -> list:
@@ -70,54 +126,32 @@ def get_containers(containers_path: str) -> list:
         'log_file': '/containers/conatiner-123/container-123-json.log'
     }
     """
-    containers = []
-
-    for container_path, _, files in os.walk(containers_path):
+    with os.scandir(containers_path) as entries:
+        container_dirs = [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
 
-        container_id = os.path.basename(container_path)
-        log_file_name = '{}-json.log'.format(container_id)
-
-        config = {}
-        source_log_file = ''
-
-        for f in files:
-            try:
-                if f == 'config.v2.json':
-                    with open(os.path.join(container_path, f)) as fp:
-                        config = json.load(fp)
-                elif f == log_file_name:
-                    # Assuming same path is mounted on node *logging agent* container.
-                    source_log_file = os.path.join(container_path, log_file_name)
-            except Exception:
-                logger.exception('Failed while retrieving config for container(%s)', container_id)
-                break
-
-        if source_log_file and config:
-            # All is good and ready!
-            containers.append({
-                'id': container_id,
-                'config': config,
-                'log_file': source_log_file
-            })
-
-            logger.debug('Successfully collected config for container(%s): %s', container_id, config)
+    containers = []
+    if container_dirs:
+        # Reading configs is I/O bound, overlap the reads of many small files.
+        max_workers = min(MAX_SCAN_WORKERS, len(container_dirs))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            containers = [c for c in executor.map(_load_container, container_dirs) if c is not None]
 
     logger.info('Collected configs for %d containers', len(containers))
 
     return containers
 
 
-def get_container_image_parts(config: dict) -> Tuple[str]:
-    docker_image_parts = config['Image'].split('/')[-1].split(':')
+def get_container_image_parts(config: dict) -> Tuple[str, str]:
+    tail = config['Image'].rpartition('/')[2]
 
-    image = docker_image_parts[0]
-    image_version = docker_image_parts[-1] if len(docker_image_parts) > 1 else 'latest'
+    image = tail.partition(':')[0]
+    _, sep, image_version = tail.rpartition(':')
 
-    return image, image_version
+    return image, image_version if sep else 'latest'
 
 
 def sync_containers_log_agents(
-        agents: list, watched_containers: set, containers: list, containers_path: str, cluster_id: str,
+        agents: list, watched_containers: set, containers: list, containers_path: str, cluster_id: Optional[str],
         kube_url=None, strict_labels=None) -> Tuple[set, set]:
     """
     Sync containers log configs using supplied agents.
@@ -125,7 +159,7 @@ def sync_containers_log_agents(
     :param agents: List of agents context managers.
     :type agents: list
 
-    :param watched_containers: Set of currently watched containers.
+    :param watched_containers: Set of currently watched containers. It is not modified.
     :type watched_containers: set
 
     :param containers: List of container configs dicts.
@@ -135,7 +169,7 @@ def sync_containers_log_agents(
     :type containers_path: str
 
     :param cluster_id: Kubernetes cluster ID. If not set, then it will not be added to job/config files.
-    :type cluster_id: str
+    :type cluster_id: str or None
 
     :param kube_url: URL to Kube API proxy.
     :type kube_url: str
@@ -147,14 +181,21 @@ def sync_containers_log_agents(
     :rtype: Tuple[set, set]
     """
 
-    new_containers = [c for c in containers if c['id'] not in watched_containers]
+    new_containers = []
+    existing_container_ids = set()
+    for container in containers:
+        container_id = container['id']
+        existing_container_ids.add(container_id)
+        if container_id not in watched_containers:
+            new_containers.append(container)
+
     new_containers_log_targets = get_new_containers_log_targets(new_containers, containers_path, cluster_id,
                                                                 kube_url=kube_url, strict_labels=strict_labels)
 
     new_container_ids = {c['id'] for c in new_containers_log_targets}
-    existing_container_ids = {c['id'] for c in containers}
     stale_container_ids = watched_containers - existing_container_ids
 
+    # Agents are flushed on idle syncs too. Flush picks up rotated API keys and restores missing job files or links.
     for agent in agents:
         try:
             with agent:
@@ -170,8 +211,16 @@ def sync_containers_log_agents(
     return new_container_ids, stale_container_ids
 
 
+def get_node_pods(node_name: str, kube_url=None) -> dict:
+    """Return pods scheduled on node ``node_name`` indexed by ``(namespace, name)``."""
+    return {
+        (pod['metadata'].get('namespace'), pod['metadata']['name']): pod
+        for pod in kube.get_pods(node_name, kube_url=kube_url)
+    }
+
+
 def get_new_containers_log_targets(
-        containers: list, containers_path: str, cluster_id: str, kube_url=None, strict_labels=None) -> list:
+        containers: list, containers_path: str, cluster_id: Optional[str], kube_url=None, strict_labels=None) -> list:
     """
     Return list of container log targets. A ``target`` includes:
         {
@@ -187,7 +236,7 @@ def get_new_containers_log_targets(
     :type containers_path: str
 
     :param cluster_id: kubernetes cluster ID. If not set, then it will not be added to job/config files.
-    :type cluster_id: str
+    :type cluster_id: str or None
 
     :param kube_url: URL to Kube API proxy.
     :type kube_url: str
@@ -200,6 +249,19 @@ def get_new_containers_log_targets(
     """
     containers_log_targets = []
     strict_labels = strict_labels or []
+    strict_labels_set = frozenset(strict_labels)
+
+    node_name = CLUSTER_NODE_NAME
+    cluster_environment = CLUSTER_ENVIRONMENT
+
+    # Same for all targets
+    base_kwargs = {'cluster_id': cluster_id, 'node_name': node_name}
+    # Ends with a separator (unless empty), container paths are built by concatenation.
+    containers_prefix = os.path.join(containers_path, '')
+
+    # Pods on this node indexed by (namespace, name), listed when first needed.
+    pods = None
+    list_pods = True
 
     for container in containers:
         try:
@@ -209,23 +271,43 @@ def get_new_containers_log_targets(
                 # We have no interest in Pause containers.
                 continue
 
-            pod_name = get_container_label_value(config, 'pod.name')
-            container_name = get_container_label_value(config, 'container.name')
-            pod_namespace = get_container_label_value(config, 'pod.namespace')
+            labels = get_container_labels(config)
+            pod_name = labels.get('pod.name')
+            container_name = labels.get('container.name')
+            pod_namespace = labels.get('pod.namespace')
+            if not pod_name:
+                # Not started by kubernetes.
+                logger.debug('Container(%s) has no pod name label ... skipping', container['id'])
+                continue
 
-            try:
-                pod = kube.get_pod(pod_name, namespace=pod_namespace, kube_url=kube_url)
-            except kube.PodNotFound:
+            if pods is None and list_pods and node_name:
+                # List all pods on this node once, instead of a request per container.
+                try:
+                    pods = get_node_pods(node_name, kube_url=kube_url)
+                except Exception:
+                    # E.g. missing ``list pods`` permission, fall back to a request per container for this sync.
+                    logger.exception('Failed to list pods on node %s, getting pod of each container instead', node_name)
+                    list_pods = False
+
+            if pods is not None:
+                pod_obj = pods.get((pod_namespace, pod_name))
+            else:
+                try:
+                    pod_obj = kube.get_pod(pod_name, namespace=pod_namespace, kube_url=kube_url).obj
+                except kube.PodNotFound:
+                    pod_obj = None
+
+            if pod_obj is None:
                 logger.warning('Cannot find pod "%s" ... skipping container: %s', pod_name, container_name)
                 continue
 
-            metadata = pod.obj['metadata']
+            metadata = pod_obj['metadata']
             pod_labels, pod_annotations = metadata.get('labels', {}), metadata.get('annotations', {})
 
-            kwargs = {}
+            kwargs = dict(base_kwargs)
 
             kwargs['container_id'] = container['id']
-            kwargs['container_path'] = os.path.join(containers_path, container['id'])
+            kwargs['container_path'] = f"{containers_prefix}{container['id']}"
             kwargs['log_file_name'] = os.path.basename(container['log_file'])
             kwargs['log_file_path'] = container['log_file']
 
@@ -233,17 +315,15 @@ def get_new_containers_log_targets(
 
             kwargs['application'] = pod_labels.get(APP_LABEL, '')
             kwargs['component'] = pod_labels.get(COMPONENT_LABEL)
-            kwargs['environment'] = pod_labels.get(ENVIRONMENT_LABEL, CLUSTER_ENVIRONMENT)
+            kwargs['environment'] = pod_labels.get(ENVIRONMENT_LABEL, cluster_environment)
             kwargs['version'] = pod_labels.get(VERSION_LABEL, '')
             kwargs['release'] = pod_labels.get('release', '')
-            kwargs['cluster_id'] = cluster_id
             kwargs['pod_name'] = pod_name
             kwargs['namespace'] = pod_namespace
             kwargs['container_name'] = container_name
-            kwargs['node_name'] = CLUSTER_NODE_NAME
             kwargs['pod_annotations'] = pod_annotations
 
-            if set(strict_labels) - set(pod_labels.keys()):
+            if strict_labels_set and not strict_labels_set.issubset(pod_labels):
                 logger.warning('Labels "%s" are required for container(%s: %s) in pod(%s) ... Skipping!',
                                ','.join(strict_labels), container_name, container['id'], pod_name)
                 continue
@@ -259,21 +339,86 @@ def load_agents(agents, configuration):
     return [BUILTIN_AGENTS[agent.strip(' ')](configuration) for agent in agents]
 
 
+def can_reconfigure_agents(agents, changed_keys) -> bool:
+    """
+    Return True if there are agents and every agent applies all ``changed_keys`` live. Otherwise new agents are
+    required.
+    """
+    return bool(agents) and all(changed_keys <= agent.live_config_keys for agent in agents)
+
+
 def load_watcher_config(watcher_config_file):
     if watcher_config_file:
         try:
+            st = os.stat(watcher_config_file)
+            key = (watcher_config_file, st.st_ino, st.st_mtime_ns, st.st_size)
+            if _config_cache['key'] == key:
+                return _config_cache['data']
+
             with open(watcher_config_file) as f:
-                return yaml.safe_load(f) or {}
+                data = yaml.load(f, Loader=YAML_LOADER) or {}
+
+            # A write within the same mtime tick as our read would go unnoticed, only cache settled files.
+            settled = time.time_ns() - st.st_mtime_ns > CONFIG_CACHE_SETTLE_NS
+            _config_cache.update(key=key if settled else None, data=data)
+
+            return data
         except Exception as error:
             logger.error('Cannot read `%s` watcher configuration file: %s', watcher_config_file, repr(error))
 
     return {}
 
 
+def watch_containers_path(containers_path):
+    """
+    Return ``inotify_simple.INotify`` watching ``containers_path`` for created and removed container dirs. Return
+    ``None`` if inotify is not available.
+    """
+    if inotify_simple is None:
+        return None
+
+    flags = inotify_simple.flags
+    try:
+        inotify = inotify_simple.INotify()
+    except OSError:
+        logger.warning('Cannot use inotify, polling containers path every interval', exc_info=True)
+        return None
+
+    try:
+        inotify.add_watch(containers_path, flags.CREATE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM)
+    except OSError:
+        logger.warning('Cannot watch containers path %s, polling every interval', containers_path, exc_info=True)
+        inotify.close()
+        return None
+
+    return inotify
+
+
+def wait_for_containers(inotify, interval: float):
+    """Sleep for ``interval`` seconds, or less if ``inotify`` reports container dirs changes."""
+    if inotify is None:
+        time.sleep(interval)
+        return
+
+    timeout = interval * 1000
+    events = inotify.read(timeout=timeout, read_delay=min(INOTIFY_READ_DELAY * 1000, timeout))
+    if events:
+        logger.debug('Containers path changed, %d events', len(events))
+
+
 def watch(containers_path, agents_list, cluster_id, interval=60, kube_url=None,
           strict_labels=None, watcher_config_file=None):
-    """Watch new containers and sync their corresponding log job/config files."""
-    # TODO: Check if filesystem watcher is *better* solution than polling.
+    """
+    Watch new containers and sync their corresponding log job/config files.
+
+    Requests to ``kube_url`` share one HTTP session for the process lifetime, so the connection stays open between
+    intervals.
+
+    If ``inotify_simple`` is installed, created or removed container dirs wake the watcher before the ``interval``
+    ends. Containers are still rescanned every ``interval``, because a container dir may be created before its
+    config and log files, and pods not found yet are retried.
+    """
+    interval = float(interval)
     watched_containers = set()
     watcher_config = load_watcher_config(watcher_config_file)
 
@@ -281,34 +426,51 @@ def watch(containers_path, agents_list, cluster_id, interval=60, kube_url=None,
 
     agents = load_agents(agents_list, configuration)
 
+    inotify = watch_containers_path(containers_path)
+
     while True:
         try:
             new_watcher_config = load_watcher_config(watcher_config_file)
             if watcher_config != new_watcher_config:
-                logger.info('Reloading agents with new configuration')
+                changed_keys = {
+                    k for k in watcher_config.keys() | new_watcher_config.keys()
+                    if watcher_config.get(k) != new_watcher_config.get(k)
+                }
                 watcher_config = new_watcher_config
                 configuration = dict(watcher_config, cluster_id=cluster_id)
-                agents = load_agents(agents_list, configuration)
-                watched_containers = set()
+
+                if can_reconfigure_agents(agents, changed_keys):
+                    logger.info('Reconfiguring agents with new configuration')
+                    for agent in agents:
+                        agent.reconfigure(configuration)
+                else:
+                    logger.info('Reloading agents with new configuration')
+                    agents = load_agents(agents_list, configuration)
+                    watched_containers = set()
 
             containers = get_containers(containers_path)
 
             # Write new job files!
             new_container_ids, stale_container_ids = sync_containers_log_agents(
-                agents, watched_containers.copy(), containers, containers_path, cluster_id, kube_url=kube_url,
+                agents, watched_containers, containers, containers_path, cluster_id, kube_url=kube_url,
                 strict_labels=strict_labels)
 
-            watched_containers.update(new_container_ids)
-            watched_containers = watched_containers - stale_container_ids  # remove old containers!
+            if new_container_ids or stale_container_ids:
+                # New set, the one passed to sync above is never modified.
+                watched_containers = (watched_containers | new_container_ids) - stale_container_ids
 
-            logger.info('Removed %d stale containers', len(stale_container_ids))
-            logger.info('Added %d new containers', len(new_container_ids))
-            logger.info('Watching %d containers', len(watched_containers))
+                if stale_container_ids:
+                    logger.info('Removed %d stale containers', len(stale_container_ids))
+                if new_container_ids:
+                    logger.info('Added %d new containers', len(new_container_ids))
+                logger.info('Watching %d containers', len(watched_containers))
 
-            time.sleep(interval)
+            wait_for_containers(inotify, interval)
         except AssertionError:
             raise
         except KeyboardInterrupt:
+            if inotify is not None:
+                inotify.close()
             return
         except Exception:
             logger.exception('Failed in watch! Retrying in %f seconds ...', interval / 2)
@@ -316,22 +478,24 @@ def watch(containers_path, agents_list, cluster_id, interval=60, kube_url=None,
 
 
 def main():
+    env = os.environ
+
     logging.basicConfig(
-        level=os.environ.get('LOGLEVEL', 'INFO').upper(),
+        level=env.get('LOGLEVEL', 'INFO').upper(),
         format='%(asctime)s %(levelname)s %(message)s',
     )
-    sentry_dsn = os.environ.get('SENTRY_DSN')
+    sentry_dsn = env.get('SENTRY_DSN')
     if sentry_dsn:
         sentry_sdk.init(
             dsn=sentry_dsn,
-            release=os.environ.get('VERSION', 'unknown'),
+            release=env.get('VERSION', 'unknown'),
             default_integrations=True,
             send_default_pii=False,
             with_locals=False,
-            environment=os.environ.get('CLUSTER_ENVIRONMENT', 'unknown'),
-            server_name='{}:{}:{}'.format(os.environ.get('CLUSTER_ALIAS', 'unknown'),
-                                          os.environ.get('CLUSTER_NODE_NAME', 'unknown'),
-                                          os.environ.get('HOSTNAME', 'unknown'))
+            environment=env.get('CLUSTER_ENVIRONMENT', 'unknown'),
+            server_name='{}:{}:{}'.format(env.get('CLUSTER_ALIAS', 'unknown'),
+                                          env.get('CLUSTER_NODE_NAME', 'unknown'),
+                                          env.get('HOSTNAME', 'unknown'))
 
         )
 
@@ -374,17 +538,17 @@ def main():
 
     args = argp.parse_args()
 
-    if args.verbose or os.environ.get('WATCHER_DEBUG'):
+    if args.verbose or env.get('WATCHER_DEBUG'):
         logger.setLevel(logging.DEBUG)
 
-    containers_path = os.environ.get('WATCHER_CONTAINERS_PATH', args.containers_path)
-    cluster_id = os.environ.get('WATCHER_CLUSTER_ID', args.cluster_id)
-    agents_str = os.environ.get('WATCHER_AGENTS', args.agents)
-    strict_labels_str = os.environ.get('WATCHER_STRICT_LABELS', args.strict_labels)
+    containers_path = env.get('WATCHER_CONTAINERS_PATH', args.containers_path)
+    cluster_id = env.get('WATCHER_CLUSTER_ID', args.cluster_id)
+    agents_str = env.get('WATCHER_AGENTS', args.agents)
+    strict_labels_str = env.get('WATCHER_STRICT_LABELS', args.strict_labels)
 
     strict_labels = strict_labels_str.split(',') if strict_labels_str else []
 
-    update_certificates = os.environ.get('WATCHER_KUBERNETES_UPDATE_CERTIFICATES', args.update_certificates)
+    update_certificates = env.get('WATCHER_KUBERNETES_UPDATE_CERTIFICATES', args.update_certificates)
     if update_certificates:
         kube.update_ca_certificate()
 
@@ -401,11 +565,11 @@ def main():
                      'Terminating watcher!', diff, BUILTIN_AGENTS)
         sys.exit(1)
 
-    kube_url = os.environ.get('WATCHER_KUBE_URL', args.kube_url)
+    kube_url = env.get('WATCHER_KUBE_URL', args.kube_url)
 
-    interval = os.environ.get('WATCHER_INTERVAL', args.interval)
+    interval = env.get('WATCHER_INTERVAL', args.interval)
 
-    watcher_config_file = os.environ.get('WATCHER_CONFIG')
+    watcher_config_file = env.get('WATCHER_CONFIG')
 
     logger.info('Loaded configuration:')
     logger.info('\tContainers path: %s', containers_path)
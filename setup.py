@@ -28,6 +28,20 @@ DESCRIPTION = 'Kubernetes log watcher'
 CONSOLE_SCRIPTS = ['kube-log-watcher=kube_log_watcher.main:main']
 
 
+def get_ext_modules():
+    """Compile the watch loop module with mypyc if ``WATCHER_MYPYC=1`` is set. Requires ``mypy``."""
+    if os.environ.get('WATCHER_MYPYC') != '1':
+        return []
+
+    try:
+        from mypyc.build import mypycify
+    except ImportError:
+        raise SystemExit('WATCHER_MYPYC=1 requires mypy in the build environment: '
+                         'pip install mypy && WATCHER_MYPYC=1 pip install --no-build-isolation .')
+
+    return mypycify(['--ignore-missing-imports', '--follow-imports=silent', os.path.join(MAIN_PACKAGE, 'main.py')])
+
+
 setup(
     name='kubernetes-log-watcher',
     version=VERSION,
@@ -35,6 +49,7 @@ setup(
     long_description=open('README.rst').read(),
     license=open('LICENSE').read(),
     packages=find_packages(exclude=['tests']),
+    ext_modules=get_ext_modules(),
     install_requires=get_requirements('requirements.txt'),
     setup_requires=['pytest-runner'],
     test_suite='tests',
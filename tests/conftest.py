@@ -125,6 +125,7 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
             {
                 'metadata': {
                     'name': 'pod-1',
+                    'namespace': 'default',
                     'labels': {'application': 'app-1', 'version': 'v1', 'release': '123',
                                'environment': 'test', 'component': 'main'},
                     'annotations': {'a/1': 'a-1', 'a/2': 'a-2'},
@@ -133,18 +134,21 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
             {
                 'metadata': {
                     'name': 'pod-2',
+                    'namespace': 'default',
                     'labels': {'application': 'app-1', 'environment': 'test'}  # missing 'version' label
                 }
             },
             {
                 'metadata': {
                     'name': 'pod-3',
+                    'namespace': 'default',
                     'labels': {'version': 'v1'}  # missing 'application' and 'environment' labels
                 }
             },
             {
                 'metadata': {
                     'name': 'pod-4',
+                    'namespace': 'kube',
                     'labels': {'application': 'app-2', 'version': 'v1', 'environment': 'test'},
                     'annotations': {},
                 }
@@ -1,3 +1,4 @@
+import copy
 import os
 
 import pytest
@@ -58,6 +59,26 @@ def test_add_log_target(monkeypatch, appdynamics_env, fx_appdynamics):
     assert agent.first_run is False
 
 
+def test_add_log_target_kwargs(monkeypatch, appdynamics_env, fx_appdynamics):
+    target = copy.deepcopy(fx_appdynamics['target'])
+    target['pod_labels'] = {'appdynamics_app': 'app', 'appdynamics_tier': 'tier'}
+    target_kwargs = copy.deepcopy(target['kwargs'])
+
+    agent = AppDynamicsAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    agent.add_log_target(target)
+
+    # Target is not modified, and annotations are not kept
+    assert target['kwargs'] == target_kwargs
+
+    kwargs = agent.logs[target['id']]['kwargs']
+    assert 'pod_annotations' not in kwargs
+    assert kwargs['app_name'] == 'app'
+    assert kwargs['app_tier'] == 'tier'
+
+
 @pytest.mark.parametrize('exc', (None, OSError))
 def test_remove_log_target(monkeypatch, appdynamics_env, exc):
     exists = MagicMock(side_effect=[True, True, False, False])
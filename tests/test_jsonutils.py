@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from kube_log_watcher import jsonutils
+
+
+@pytest.fixture(params=(True, False))
+def fx_orjson(monkeypatch, request):
+    if not request.param:
+        monkeypatch.setattr('kube_log_watcher.jsonutils.orjson', None)
+
+
+@pytest.mark.parametrize('data', (
+    '{"a": [1, 2.5, null, true], "b": "ü"}',
+    b'{"a": [1, 2.5, null, true], "b": "\xc3\xbc"}',
+))
+def test_loads(fx_orjson, data):
+    assert jsonutils.loads(data) == {'a': [1, 2.5, None, True], 'b': 'ü'}
+
+
+@pytest.mark.parametrize('data', ('[{]', b'', 'not json'))
+def test_loads_invalid(fx_orjson, data):
+    with pytest.raises(jsonutils.JSONDecodeError):
+        jsonutils.loads(data)
+
+
+def test_dumps(fx_orjson):
+    obj = {'a': [1, 2.5, None, True], 'b': 'ü', 'c': {'d': '"quoted"'}}
+
+    res = jsonutils.dumps(obj)
+
+    assert isinstance(res, str)
+    assert ' ' not in res.replace('"quoted"', '')
+    assert json.loads(res) == obj
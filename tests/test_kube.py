@@ -1,9 +1,10 @@
+import pykube
 import pykube.exceptions
 import pytest
 from mock import MagicMock
 
-from kube_log_watcher.kube import PAUSE_CONTAINER_PREFIX, DEFAULT_SERVICE_ACC
-from kube_log_watcher.kube import get_pod, is_pause_container, get_client, PodNotFound
+from kube_log_watcher.kube import PAUSE_CONTAINER_PREFIX, DEFAULT_SERVICE_ACC, _session
+from kube_log_watcher.kube import get_pod, get_pods, is_pause_container, get_client, PodNotFound
 
 KUBE_URL = 'https://my-kube-api'
 
@@ -56,7 +57,7 @@ def test_get_pod_url(monkeypatch, namespace):
     res = [1]
     get.return_value.json.return_value = {'items': res}
 
-    monkeypatch.setattr('requests.get', get)
+    monkeypatch.setattr('kube_log_watcher.kube._session.get', get)
 
     result = get_pod('my-pod', namespace=namespace, kube_url=KUBE_URL)
 
@@ -113,6 +114,49 @@ def test_get_pod_pykube_not_found(monkeypatch, namespace):
     pykube_pod_objects.get_by_name.assert_called_with('my-pod')
 
 
+def test_get_pods_url(monkeypatch):
+    get = MagicMock()
+    get.return_value.json.return_value = {'items': PODS[:2]}
+
+    monkeypatch.setattr('kube_log_watcher.kube._session.get', get)
+
+    result = get_pods('node-1', kube_url=KUBE_URL)
+
+    assert result == PODS[:2]
+
+    get.assert_called_with('https://my-kube-api/api/v1/pods', params={'fieldSelector': 'spec.nodeName=node-1'})
+    get.return_value.raise_for_status.assert_called_once()
+
+
+def test_get_pods_pykube(monkeypatch):
+    mock_client = MagicMock(name='client')
+
+    pykube_pod = MagicMock()
+    pykube_pod_objects = MagicMock()
+
+    pykube_pod.objects.return_value = pykube_pod_objects
+    pykube_pod_objects.filter.return_value = [POD_OBJ]
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_client', lambda: mock_client)
+    monkeypatch.setattr('pykube.Pod', pykube_pod)
+
+    result = get_pods('node-1')
+
+    assert result == [POD_OBJ.obj]
+
+    pykube_pod.objects.assert_called_with(api=mock_client, namespace=pykube.all)
+    pykube_pod_objects.filter.assert_called_with(field_selector={'spec.nodeName': 'node-1'})
+
+
+def test_session():
+    for prefix in ('http://', 'https://'):
+        adapter = _session.get_adapter(prefix + 'my-kube-api')
+        assert adapter._pool_connections == 4
+        assert adapter._pool_maxsize == 16
+
+    assert _session.headers['User-Agent'].startswith('kube-log-watcher/')
+
+
 @pytest.mark.parametrize(
     'config,res',
     (
@@ -121,6 +165,12 @@ def test_get_pod_pykube_not_found(monkeypatch, namespace):
             ({}, False),
             ({'Image': PAUSE_CONTAINER_PREFIX[:-1]}, False),
             ({'Image': PAUSE_CONTAINER_PREFIX[1:]}, False),
+            ({'Image': 'registry.k8s.io/pause:3.9'}, True),
+            ({'Image': 'k8s.gcr.io/pause'}, True),
+            ({'Image': 'k8s.gcr.io/pause@sha256:927d98197ec1141a368550822d18fa1c'}, True),
+            ({'Image': 'registry.k8s.io:443/pause:3.9'}, False),
+            ({'Image': 'registry.k8s.io/pause-service:1.0'}, False),
+            ({'Image': 'repo/pause:1.0'}, False),
     )
 )
 def test_pause_container(monkeypatch, config, res):
@@ -1,13 +1,18 @@
+import json
+import logging
 import os
 
 import pytest
+import yaml
 
 from mock import MagicMock, call
 
+from kube_log_watcher.agents import BaseWatcher
 from kube_log_watcher.kube import PodNotFound
 from kube_log_watcher.main import (
-    get_container_label_value, get_containers, sync_containers_log_agents, load_agents,
-    get_new_containers_log_targets, get_container_image_parts, watch)
+    get_container_labels, get_containers, sync_containers_log_agents, load_agents,
+    get_new_containers_log_targets, get_container_image_parts, load_watcher_config, watch, watch_containers_path,
+    wait_for_containers, BUILTIN_AGENTS)
 
 from .conftest import CLUSTER_ID
 
@@ -42,6 +47,8 @@ def pod_mock(metadata):
     ('repo/image-1', ('image-1', 'latest')),
     ('repo/', ('', 'latest')),
     ('repo/vendor/project/image-1:0.1-alpha-1', ('image-1', '0.1-alpha-1')),
+    ('registry:5000/image-1', ('image-1', 'latest')),
+    ('image-1:', ('image-1', '')),
 ))
 def test_get_container_image_parts(monkeypatch, image, res):
     config = {'Image': image}
@@ -50,51 +57,70 @@ def test_get_container_image_parts(monkeypatch, image, res):
 
 
 @pytest.mark.parametrize(
-    'label,val',
+    'labels,res',
     (
-        ('pod.name', 'pod-name'),
-        ('pod.namespace', 'default'),
-        ('io.kubernetes.container.name', 'container-1'),
-        ('container.nam', None),
+        (
+            CONFIG['Config']['Labels'],
+            {'pod.name': 'pod-name', 'pod.namespace': 'default', 'container.name': 'container-1'},
+        ),
+        (
+            {'pod.name': 'pod-1', 'annotation.some-annotation': 'v1'},
+            {'pod.name': 'pod-1', 'annotation.some-annotation': 'v1'},
+        ),
+        (
+            {},
+            {},
+        ),
     )
 )
-def test_get_container_label_value(monkeypatch, label, val):
-    assert val == get_container_label_value(CONFIG, label)
+def test_get_container_labels(monkeypatch, labels, res):
+    assert get_container_labels({'Config': {'Labels': labels}}) == res
 
 
 @pytest.mark.parametrize(
-    'walk,config,res,exc',
+    'files,config,res,exc',
     (
         (
-            [('/mnt/containers/cont-1', '', ['config.v2.json', 'cont-1-json.log'])],
+            ['config.v2.json', 'cont-1-json.log'],
             {'Config': ''},
-            [{'id': 'cont-1', 'config': {'Config': ''}, 'log_file': '/mnt/containers/cont-1/cont-1-json.log'}],
+            [{'id': 'cont-1', 'config': {'Config': ''}, 'log_file': 'cont-1/cont-1-json.log'}],
             None,
         ),
         (
-            [('/mnt/containers/cont-1', '', ['config.v2.json'])],
+            ['config.v2.json'],
             {'Config': ''},
             [],
             None,
         ),
         (
-            [('/mnt/containers/cont-1', '', ['cont-1-json.log'])],
+            ['cont-1-json.log'],
             {'Config': ''},
             [],
             None
         ),
         (
-            [('/mnt/containers/cont-1', '', ['config.v2.json', 'cont-1-json.log'])],
+            ['config.v2.json', 'cont-1-json.log'],
+            {},
+            [],
+            None
+        ),
+        (
+            ['config.v2.json', 'cont-1-json.log'],
             {'Config': ''},
             [],
             OSError,
         ),
     )
 )
-def test_get_containers(monkeypatch, walk, config, res, exc):
-    mock_open = MagicMock()
+def test_get_containers(monkeypatch, tmp_path, files, config, res, exc):
+    container_dir = tmp_path / 'cont-1'
+    container_dir.mkdir()
+    for f in files:
+        (container_dir / f).write_text(json.dumps(config))
 
-    mock_walk = MagicMock(return_value=walk)
+    # Files and symlinks next to container dirs are ignored
+    (tmp_path / 'cont-2').write_text('')
+    (tmp_path / 'cont-3').symlink_to(container_dir)
 
     mock_load = MagicMock()
     if exc:
@@ -102,18 +128,35 @@ def test_get_containers(monkeypatch, walk, config, res, exc):
     else:
         mock_load.return_value = config
 
-    monkeypatch.setattr('builtins.open', mock_open)
-    monkeypatch.setattr('os.walk', mock_walk)
-    monkeypatch.setattr('json.load', mock_load)
+    monkeypatch.setattr('kube_log_watcher.jsonutils.loads', mock_load)
+
+    containers = get_containers(str(tmp_path))
 
-    containers = get_containers(CONTAINERS_PATH)
+    for container in res:
+        container['log_file'] = str(tmp_path / container['log_file'])
 
     assert containers == res
 
-    mock_walk.assert_called_with(CONTAINERS_PATH)
-    if 'config.v2.json' in walk[0][-1][0]:
-        mock_open.assert_called_with(os.path.join(walk[0][0], 'config.v2.json'))
-        mock_load.assert_called()
+    if 'config.v2.json' in files and 'cont-1-json.log' in files:
+        mock_load.assert_called_once()
+    else:
+        mock_load.assert_not_called()
+
+
+def test_get_containers_many(tmp_path):
+    for i in range(10):
+        container_dir = tmp_path / 'cont-{}'.format(i)
+        container_dir.mkdir()
+        (container_dir / 'cont-{}-json.log'.format(i)).write_text('')
+        # One broken config must not abort loading the others
+        (container_dir / 'config.v2.json').write_text('{' if i == 3 else json.dumps({'Config': {'Id': i}}))
+
+    containers = get_containers(str(tmp_path))
+
+    assert sorted(c['id'] for c in containers) == ['cont-{}'.format(i) for i in range(10) if i != 3]
+    for container in containers:
+        assert container['config'] == {'Config': {'Id': int(container['id'].split('-')[1])}}
+        assert container['log_file'] == str(tmp_path / container['id'] / '{}-json.log'.format(container['id']))
 
 
 @pytest.mark.parametrize(
@@ -127,9 +170,9 @@ def test_get_containers(monkeypatch, walk, config, res, exc):
 def test_sync_containers_log_agents(monkeypatch, watched_containers, fx_containers_sync):
     containers, pods, targets, _, result = fx_containers_sync
 
-    get_pod = MagicMock(side_effect=pods)
+    get_pods = MagicMock(return_value=pods)
 
-    monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
     monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
 
     stale_containers = watched_containers - result
@@ -144,9 +187,13 @@ def test_sync_containers_log_agents(monkeypatch, watched_containers, fx_containe
     agent2 = MagicMock()
     agents = [agent1, agent2]
 
+    watched_containers_before = set(watched_containers)
+
     existing, stale = sync_containers_log_agents(agents, watched_containers, containers, CONTAINERS_PATH, CLUSTER_ID,
                                                  strict_labels=[])
 
+    assert watched_containers == watched_containers_before
+
     get_targets.assert_called_with([c for c in containers if c['id'] not in watched_containers],
                                    CONTAINERS_PATH, CLUSTER_ID, kube_url=None, strict_labels=[])
     assert existing == result
@@ -174,9 +221,9 @@ def test_sync_containers_log_agents(monkeypatch, watched_containers, fx_containe
 def test_sync_containers_log_agents_failure(monkeypatch, watched_containers, fx_containers_sync):
     containers, pods, targets, _, result = fx_containers_sync
 
-    get_pod = MagicMock(side_effect=pods)
+    get_pods = MagicMock(return_value=pods)
 
-    monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
     monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
 
     stale_containers = watched_containers - result
@@ -201,9 +248,86 @@ def test_sync_containers_log_agents_failure(monkeypatch, watched_containers, fx_
 def test_get_new_containers_log_targets(monkeypatch, fx_containers_sync):
     containers, pods, result, _, _ = fx_containers_sync
 
+    get_pods = MagicMock(return_value=pods)
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
+    monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
+
+    targets = get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID,
+                                             strict_labels=['application', 'version'])
+
+    assert targets == result
+
+    get_pods.assert_called_once_with('node-1', kube_url=None)
+
+
+def test_get_new_containers_log_targets_containers_path(monkeypatch, fx_containers_sync):
+    containers, pods, result, _, _ = fx_containers_sync
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', MagicMock(return_value=pods))
+    monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
+
+    targets = get_new_containers_log_targets(containers, CONTAINERS_PATH.rstrip('/'), CLUSTER_ID,
+                                             strict_labels=['application', 'version'])
+
+    assert [t['kwargs']['container_path'] for t in targets] == [t['kwargs']['container_path'] for t in result]
+
+
+def test_get_new_containers_log_targets_no_node_name(monkeypatch, fx_containers_sync):
+    containers, pods, result, _, _ = fx_containers_sync
+
+    get_pod = MagicMock(side_effect=[pod_mock(p) for p in pods])
+    get_pods = MagicMock()
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
+    monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', None)
+
+    targets = get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID,
+                                             strict_labels=['application', 'version'])
+
+    assert [t['id'] for t in targets] == [t['id'] for t in result]
+
+    assert get_pod.call_count == len(pods)
+    get_pods.assert_not_called()
+
+
+def test_get_new_containers_log_targets_no_node_name_not_found_pods(monkeypatch, fx_containers_sync):
+    containers, _, _, _, _ = fx_containers_sync
+
+    get_pod = MagicMock(side_effect=PodNotFound)
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', None)
+
+    assert get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID) == []
+
+
+def test_get_new_containers_log_targets_no_pod_name(monkeypatch):
+    containers = [{
+        'id': 'cont-1',
+        'config': {'Config': {'Labels': {'com.example.service': 'db'}, 'Image': 'db:1.0'}},
+        'log_file': '/mnt/containers/cont-1/cont-1-json.log',
+    }]
+
+    get_pods = MagicMock(return_value=[])
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
+    monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
+
+    assert get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID) == []
+
+    get_pods.assert_not_called()
+
+
+def test_get_new_containers_log_targets_list_pods_failure(monkeypatch, fx_containers_sync):
+    containers, pods, result, _, _ = fx_containers_sync
+
     get_pod = MagicMock(side_effect=[pod_mock(p) for p in pods])
+    get_pods = MagicMock(side_effect=Exception)
 
     monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
     monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
 
     targets = get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID,
@@ -211,13 +335,30 @@ def test_get_new_containers_log_targets(monkeypatch, fx_containers_sync):
 
     assert targets == result
 
+    get_pods.assert_called_once_with('node-1', kube_url=None)
+    assert get_pod.call_count == len(pods)
+
+
+def test_get_new_containers_log_targets_pause_only(monkeypatch, fx_containers_sync):
+    containers, _, _, _, _ = fx_containers_sync
+
+    get_pods = MagicMock(return_value=[])
+
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
+    monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
+
+    pause_containers = [c for c in containers if 'pause' in c['config']['Config']['Image']]
+    assert get_new_containers_log_targets(pause_containers, CONTAINERS_PATH, CLUSTER_ID) == []
+
+    get_pods.assert_not_called()
+
 
 def test_get_new_containers_log_targets_not_found_pods(monkeypatch, fx_containers_sync):
     containers, pods, _, _, _ = fx_containers_sync
 
-    get_pod = MagicMock(side_effect=PodNotFound)
+    get_pods = MagicMock(return_value=[])
 
-    monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
     monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
 
     targets = get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID,
@@ -246,9 +387,9 @@ def test_get_new_containers_log_targets_no_strict_labels(monkeypatch, fx_contain
 
     result = result_labels + result_no_labels
 
-    get_pod = MagicMock(side_effect=[pod_mock(p) for p in pods])
+    get_pods = MagicMock(return_value=pods)
 
-    monkeypatch.setattr('kube_log_watcher.kube.get_pod', get_pod)
+    monkeypatch.setattr('kube_log_watcher.kube.get_pods', get_pods)
     monkeypatch.setattr('kube_log_watcher.main.CLUSTER_NODE_NAME', 'node-1')
 
     targets = get_new_containers_log_targets(containers, CONTAINERS_PATH, CLUSTER_ID)
@@ -380,12 +521,12 @@ def test_load_configuration(monkeypatch, tmp_path):
             assert watched_containers == {'new0', 'new1', 'new2'}
         elif step == 4:
             assert watched_containers == {'new0', 'new1', 'new2', 'new3'}
-            watcher_config_file.write_text('{"foo": "bar"}')
+            watcher_config_file.write_text('{"symlink_dir": "bar"}')
         elif step == 5:
             assert watched_containers == set()
         elif step == 6:
             assert watched_containers == {'new5'}
-            watcher_config_file.write_text('{"foo": "baz"}')
+            watcher_config_file.write_text('{"symlink_dir": "baz"}')
         elif step == 7:
             assert watched_containers == set()
         else:
@@ -404,6 +545,210 @@ def test_load_configuration(monkeypatch, tmp_path):
 
     load_agents_mock.assert_has_calls([
         call([], {'cluster_id': 'kube-cluster'}),
-        call([], {'foo': 'bar', 'cluster_id': 'kube-cluster'}),
-        call([], {'foo': 'baz', 'cluster_id': 'kube-cluster'}),
+        call([], {'symlink_dir': 'bar', 'cluster_id': 'kube-cluster'}),
+        call([], {'symlink_dir': 'baz', 'cluster_id': 'kube-cluster'}),
+    ])
+
+
+def test_reconfigure_configuration(monkeypatch, tmp_path):
+    watcher_config_file = tmp_path / 'log-watcher.yaml'
+    watcher_config_file.write_text('{"foo": "bar"}')
+
+    monkeypatch.setattr('kube_log_watcher.main.get_containers', MagicMock(return_value=[]))
+
+    agent = MagicMock(live_config_keys=frozenset(('foo',)))
+    load_agents_mock = MagicMock(return_value=[agent])
+    monkeypatch.setattr('kube_log_watcher.main.load_agents', load_agents_mock)
+
+    step = 0
+
+    def sync_containers_log_agents(
+        agents, watched_containers, containers, containers_path, cluster_id,
+        kube_url=None, strict_labels=None,
+    ):
+        nonlocal step
+
+        assert agents == [agent]
+
+        if step == 0:
+            assert watched_containers == set()
+            watcher_config_file.write_text('{"foo": "baz"}')
+        elif step == 1:
+            # Agents are reconfigured in place, watched containers are kept
+            assert watched_containers == {'new0'}
+        else:
+            raise KeyboardInterrupt
+
+        new_container_ids = {'new' + str(step)}
+
+        step += 1
+        return new_container_ids, set()
+
+    monkeypatch.setattr('kube_log_watcher.main.sync_containers_log_agents', sync_containers_log_agents)
+    watch(CONTAINERS_PATH, [], CLUSTER_ID, interval=0.001, watcher_config_file=str(watcher_config_file))
+
+    load_agents_mock.assert_called_once_with([], {'foo': 'bar', 'cluster_id': 'kube-cluster'})
+    agent.reconfigure.assert_called_once_with({'foo': 'baz', 'cluster_id': 'kube-cluster'})
+
+
+def test_reload_agents_on_init_configuration(monkeypatch, tmp_path):
+    watcher_config_file = tmp_path / 'log-watcher.yaml'
+    watcher_config_file.write_text('{"foo": "bar", "bar": 1}')
+
+    class Agent(BaseWatcher):
+        live_config_keys = frozenset(('bar',))
+
+        def __init__(self, configuration):
+            self.foo = configuration['foo']
+
+    monkeypatch.setitem(BUILTIN_AGENTS, 'test', Agent)
+    monkeypatch.setattr('kube_log_watcher.main.get_containers', MagicMock(return_value=[]))
+
+    step = 0
+    agents_by_step = []
+
+    def sync_containers_log_agents(
+        agents, watched_containers, containers, containers_path, cluster_id,
+        kube_url=None, strict_labels=None,
+    ):
+        nonlocal step
+
+        agents_by_step.append(agents[0])
+
+        if step == 0:
+            # Live key only, agent is kept
+            watcher_config_file.write_text('{"foo": "bar", "bar": 2}')
+        elif step == 1:
+            # Key not applied live, agent is created again
+            watcher_config_file.write_text('{"foo": "baz", "bar": 2}')
+        elif step == 2:
+            assert watched_containers == set()
+        else:
+            raise KeyboardInterrupt
+
+        new_container_ids = {'new' + str(step)}
+
+        step += 1
+        return new_container_ids, set()
+
+    monkeypatch.setattr('kube_log_watcher.main.sync_containers_log_agents', sync_containers_log_agents)
+    watch(CONTAINERS_PATH, ['test'], CLUSTER_ID, interval=0.001, watcher_config_file=str(watcher_config_file))
+
+    assert agents_by_step[0] is agents_by_step[1]
+    assert agents_by_step[2] is not agents_by_step[1]
+    assert agents_by_step[2].foo == 'baz'
+
+
+def test_load_watcher_config_cached(monkeypatch, tmp_path):
+    watcher_config_file = tmp_path / 'log-watcher.yaml'
+    watcher_config_file.write_text('foo: bar')
+
+    load = MagicMock(wraps=yaml.load)
+    monkeypatch.setattr('yaml.load', load)
+
+    # Recently modified file is not cached, a write in the same mtime tick could be missed.
+    assert load_watcher_config(str(watcher_config_file)) == {'foo': 'bar'}
+    assert load_watcher_config(str(watcher_config_file)) == {'foo': 'bar'}
+    assert load.call_count == 2
+
+    os.utime(str(watcher_config_file), (1, 1))
+
+    assert load_watcher_config(str(watcher_config_file)) == {'foo': 'bar'}
+    assert load_watcher_config(str(watcher_config_file)) == {'foo': 'bar'}
+    assert load.call_count == 3
+
+    watcher_config_file.write_text('foo: baz')
+    os.utime(str(watcher_config_file), (2, 2))
+
+    assert load_watcher_config(str(watcher_config_file)) == {'foo': 'baz'}
+    assert load.call_count == 4
+
+
+def test_load_watcher_config_missing(tmp_path):
+    assert load_watcher_config(str(tmp_path / 'missing.yaml')) == {}
+    assert load_watcher_config(None) == {}
+
+
+def test_watch_containers_path_no_inotify(monkeypatch):
+    monkeypatch.setattr('kube_log_watcher.main.inotify_simple', None)
+
+    assert watch_containers_path(CONTAINERS_PATH) is None
+
+
+def test_watch_containers_path(monkeypatch):
+    inotify_simple = MagicMock()
+    monkeypatch.setattr('kube_log_watcher.main.inotify_simple', inotify_simple)
+
+    flags = inotify_simple.flags
+
+    inotify = watch_containers_path(CONTAINERS_PATH)
+
+    assert inotify == inotify_simple.INotify.return_value
+    inotify.add_watch.assert_called_once_with(
+        CONTAINERS_PATH, flags.CREATE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM)
+
+
+def test_watch_containers_path_failure(monkeypatch):
+    inotify_simple = MagicMock()
+    inotify_simple.INotify.return_value.add_watch.side_effect = OSError
+    monkeypatch.setattr('kube_log_watcher.main.inotify_simple', inotify_simple)
+
+    assert watch_containers_path(CONTAINERS_PATH) is None
+
+    inotify_simple.INotify.return_value.close.assert_called_once()
+
+
+@pytest.mark.parametrize('interval,read_delay', ((60, 1000), (0.5, 500)))
+def test_wait_for_containers(monkeypatch, interval, read_delay):
+    sleep = MagicMock()
+    monkeypatch.setattr('time.sleep', sleep)
+
+    wait_for_containers(None, interval)
+    sleep.assert_called_once_with(interval)
+
+    inotify = MagicMock()
+    inotify.read.return_value = [MagicMock()]
+
+    wait_for_containers(inotify, interval)
+    inotify.read.assert_called_once_with(timeout=interval * 1000, read_delay=read_delay)
+    sleep.assert_called_once()
+
+
+def test_watch_inotify(monkeypatch):
+    inotify = MagicMock()
+    monkeypatch.setattr('kube_log_watcher.main.watch_containers_path', MagicMock(return_value=inotify))
+    monkeypatch.setattr('kube_log_watcher.main.get_containers', MagicMock(return_value=[]))
+    monkeypatch.setattr('kube_log_watcher.main.load_agents', MagicMock(return_value=[]))
+
+    sync = MagicMock(side_effect=[(set(), set()), KeyboardInterrupt])
+    monkeypatch.setattr('kube_log_watcher.main.sync_containers_log_agents', sync)
+
+    # Interval from env variable is a string
+    watch(CONTAINERS_PATH, [], CLUSTER_ID, interval='30')
+
+    inotify.read.assert_called_once_with(timeout=30000, read_delay=1000)
+    inotify.close.assert_called_once()
+
+
+def test_watch_logs_changes_only(monkeypatch, caplog):
+    monkeypatch.setattr('kube_log_watcher.main.watch_containers_path', MagicMock(return_value=None))
+    monkeypatch.setattr('kube_log_watcher.main.get_containers', MagicMock(return_value=[]))
+    monkeypatch.setattr('kube_log_watcher.main.load_agents', MagicMock(return_value=[]))
+
+    sync = MagicMock(side_effect=[
+        ({'cont-1', 'cont-2'}, set()),
+        (set(), set()),
+        (set(), {'cont-1'}),
+        KeyboardInterrupt,
     ])
+    monkeypatch.setattr('kube_log_watcher.main.sync_containers_log_agents', sync)
+
+    with caplog.at_level(logging.INFO, logger='kube_log_watcher.main'):
+        watch(CONTAINERS_PATH, [], CLUSTER_ID, interval=0.001)
+
+    assert [r.getMessage() for r in caplog.records] == [
+        'Added 2 new containers',
+        'Watching 2 containers',
+        'Removed 1 stale containers',
+        'Watching 1 containers',
+    ]
@@ -4,17 +4,19 @@ import copy
 
 import pytest
 
-from mock import MagicMock
+from mock import MagicMock, call
 from urllib.parse import quote_plus
 
-from kube_log_watcher.template_loader import load_template, env
+from kube_log_watcher.template_loader import load_template
 from kube_log_watcher.agents.scalyr \
-    import ScalyrAgent, SCALYR_CONFIG_PATH, TPL_NAME, JWT_REDACTION_RULE,\
-    get_parser, get_sampling_rules, get_redaction_rules, container_annotation
+    import ScalyrAgent, SCALYR_CONFIG_PATH, TPL_NAME, LOG_TPL_NAME, JWT_REDACTION_RULE,\
+    get_parser, get_sampling_rules, get_redaction_rules, container_annotation,\
+    build_agent_config, build_log_config, dump_agent_config, LogEntry, SCALYR_ANNOTATION_SAMPLING_RULES
 
 from .conftest \
     import CLUSTER_ID, CLUSTER_ENVIRONMENT, CLUSTER_ALIAS, NODE, APPLICATION, VERSION, COMPONENT, CONTAINER_ID
 from .conftest import SCALYR_KEY, SCALYR_DEST_PATH, SCALYR_JOURNALD_DEFAULTS, SCALYR_DEFAULT_PARSER
+from .conftest import TARGET, TARGET_NO_ANNOT
 
 DEFAULT_ENV = {
     'CLUSTER_ENVIRONMENT': CLUSTER_ENVIRONMENT,
@@ -142,28 +144,36 @@ def scalyr_env(monkeypatch, scalyr_key_file, request):
 def patch_os(monkeypatch):
     makedirs = MagicMock()
     symlink = MagicMock()
-    listdir = MagicMock(return_value=[])
+    scandir = MagicMock()
+    scandir.return_value.__enter__.return_value = iter([])
 
     monkeypatch.setattr('os.makedirs', makedirs)
     monkeypatch.setattr('os.symlink', symlink)
-    monkeypatch.setattr('os.listdir', listdir)
+    monkeypatch.setattr('os.scandir', scandir)
 
-    return makedirs, symlink, listdir
+    return makedirs, symlink, scandir
 
 
 def patch_open(monkeypatch, exc=None):
     mock_open = MagicMock()
     mock_fp = MagicMock()
     mock_open.return_value.__enter__.return_value = mock_fp
+    mock_fp.read.return_value = SCALYR_KEY
 
     if exc:
         mock_fp.side_effect = exc
 
     monkeypatch.setattr('builtins.open', mock_open)
+    monkeypatch.setattr('os.replace', MagicMock())
 
     return mock_open, mock_fp
 
 
+def log_entry(log):
+    return LogEntry(log['path'], log['attributes'], sampling_rules=log.get('sampling_rules'),
+                    redaction_rules=log.get('redaction_rules'), parse_lines_as_json=log.get('parse_lines_as_json'))
+
+
 @pytest.mark.parametrize(
     'env,isdir',
     (
@@ -216,6 +226,23 @@ def test_initialization_failure(monkeypatch, scalyr_key_file, env, isdir):
         })
 
 
+def test_initialization_watched_containers(monkeypatch, scalyr_key_file, tmp_path, caplog):
+    dest_path = tmp_path / 'watcher'
+    for container_id in ('container-1', 'container-2'):
+        (dest_path / container_id).mkdir(parents=True)
+
+    patch_env(monkeypatch, scalyr_key_file, {**DEFAULT_ENV, 'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+                                             'WATCHER_SCALYR_DEST_PATH': str(dest_path)})
+
+    with caplog.at_level('DEBUG', logger='kube_log_watcher.agents.scalyr'):
+        ScalyrAgent({
+            'cluster_id': CLUSTER_ID,
+        })
+
+    assert 'Scalyr watcher agent found 2 watched containers.' in caplog.messages
+    assert any('container-1' in m and 'container-2' in m for m in caplog.messages)
+
+
 def test_add_log_target(monkeypatch, scalyr_env, fx_scalyr):
     target = fx_scalyr['target']
     kwargs = fx_scalyr['kwargs']
@@ -231,10 +258,7 @@ def test_add_log_target(monkeypatch, scalyr_env, fx_scalyr):
     exists = MagicMock(side_effect=[True, False, False, True])
     monkeypatch.setattr('os.path.exists', exists)
 
-    makedirs, symlink, listdir = patch_os(monkeypatch)
-
-    current_targets = MagicMock(return_value=set())
-    monkeypatch.setattr(ScalyrAgent, '_get_current_log_paths', current_targets)
+    makedirs, symlink, scandir = patch_os(monkeypatch)
 
     agent = ScalyrAgent({
         'cluster_id': CLUSTER_ID,
@@ -246,21 +270,83 @@ def test_add_log_target(monkeypatch, scalyr_env, fx_scalyr):
     with agent:
         agent.add_log_target(target)
         if kwargs['logs'][0]['attributes']['parser'] == SCALYR_DEFAULT_PARSER:
-            assert 'parser' not in agent.logs[target['id']]['attributes']
+            assert 'parser' not in agent.logs[target['id']].attributes
         else:
-            assert agent.logs[target['id']]['attributes']['parser'] == kwargs['logs'][0]['attributes']['parser']
+            assert agent.logs[target['id']].attributes['parser'] == kwargs['logs'][0]['attributes']['parser']
 
     log_path = kwargs['logs'][0]['path']
 
-    makedirs.assert_called_with(os.path.dirname(log_path))
+    makedirs.assert_called_with(os.path.dirname(log_path), exist_ok=True)
     symlink.assert_called_with(target['kwargs']['log_file_path'], log_path)
 
-    mock_open.assert_called_with(agent.config_path, 'w')
+    mock_open.assert_called_with(agent.config_path + '.tmp', 'wb')
+    os.replace.assert_called_once_with(agent.config_path + '.tmp', agent.config_path)
     mock_fp.write.assert_called_once()
 
     assert agent.first_run is False
 
 
+@pytest.mark.parametrize(
+    'parse_lines_json,parser,parse_lines_as_json',
+    (
+        ('', 'custom-parser', False),
+        ('other-parser', 'custom-parser', False),
+        ('custom-parser', 'custom-parser', True),
+        ('other-parser, custom-parser=json-parser', 'json-parser', True),
+        ('*', 'custom-parser', True),
+        ('*,custom-parser=json-parser', 'json-parser', True),
+    )
+)
+def test_add_log_target_parse_lines_json(monkeypatch, scalyr_key_file, parse_lines_json, parser,
+                                         parse_lines_as_json):
+    patch_env(monkeypatch, scalyr_key_file, {**DEFAULT_ENV, 'WATCHER_SCALYR_PARSE_LINES_JSON': parse_lines_json})
+    patch_os(monkeypatch)
+
+    isdir = MagicMock(side_effect=[True, True])
+    monkeypatch.setattr('os.path.isdir', isdir)
+
+    exists = MagicMock(return_value=True)
+    monkeypatch.setattr('os.path.exists', exists)
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    agent.add_log_target(TARGET)
+
+    assert isinstance(agent.logs[TARGET['id']], LogEntry)
+    assert agent.logs[TARGET['id']].attributes['parser'] == parser
+    assert agent.logs[TARGET['id']].parse_lines_as_json is parse_lines_as_json
+
+
+def test_add_log_target_interned_attributes(monkeypatch, scalyr_env):
+    patch_os(monkeypatch)
+
+    monkeypatch.setattr('os.path.isdir', MagicMock(return_value=True))
+    monkeypatch.setattr('os.path.exists', MagicMock(return_value=True))
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    targets = []
+    for i in range(2):
+        target = copy.deepcopy(TARGET_NO_ANNOT)
+        target['id'] = target['kwargs']['container_id'] = 'container-{}'.format(i)
+        # Build values at runtime, so they are distinct string objects
+        target['kwargs']['application'] = ''.join(['app', '-1'])
+        target['kwargs']['namespace'] = ''.join(['def', 'ault'])
+        targets.append(target)
+        agent.add_log_target(target)
+
+    first, second = (agent.logs[target['id']].attributes for target in targets)
+
+    assert targets[0]['kwargs']['application'] is not targets[1]['kwargs']['application']
+    assert first['application'] is second['application']
+    assert first['namespace'] is second['namespace']
+    assert first['container_id'] != second['container_id']
+
+
 def test_add_log_target_no_src(monkeypatch, scalyr_env, fx_scalyr):
     patch_os(monkeypatch)
 
@@ -283,6 +369,40 @@ def test_add_log_target_no_src(monkeypatch, scalyr_env, fx_scalyr):
     assert agent.logs == {}
 
 
+def test_add_log_target_existing_symlink(monkeypatch, scalyr_env):
+    isdir = MagicMock(side_effect=[True, True])
+    monkeypatch.setattr('os.path.isdir', isdir)
+
+    exists = MagicMock(return_value=True)
+    monkeypatch.setattr('os.path.exists', exists)
+
+    makedirs, symlink, scandir = patch_os(monkeypatch)
+    symlink.side_effect = FileExistsError
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    log_path = os.path.join(SCALYR_DEST_PATH, 'container-1', 'app-1-v1.log')
+
+    agent.add_log_target(TARGET)
+    assert agent.logs[TARGET['id']].path == log_path
+
+    # Adding the same target again does not touch the file system
+    agent.add_log_target(TARGET)
+    assert agent.logs[TARGET['id']].path == log_path
+    assert agent._log_paths == {log_path}
+
+    exists.assert_called_once_with(TARGET['kwargs']['log_file_path'])
+    makedirs.assert_called_once_with(os.path.dirname(log_path), exist_ok=True)
+    symlink.assert_called_once_with(TARGET['kwargs']['log_file_path'], log_path)
+
+    monkeypatch.setattr('shutil.rmtree', MagicMock())
+    agent.remove_log_target(TARGET['id'])
+    assert agent.logs == {}
+    assert agent._log_paths == set()
+
+
 def test_add_log_target_no_change(monkeypatch, scalyr_env, fx_scalyr):
     target = fx_scalyr['target']
     kwargs = fx_scalyr['kwargs']
@@ -298,14 +418,10 @@ def test_add_log_target_no_change(monkeypatch, scalyr_env, fx_scalyr):
     exists = MagicMock(side_effect=[True, False, False, True])
     monkeypatch.setattr('os.path.exists', exists)
 
-    makedirs, symlink, listdir = patch_os(monkeypatch)
+    makedirs, symlink, scandir = patch_os(monkeypatch)
 
     log_path = kwargs['logs'][0]['path']
 
-    # targets did not change
-    current_targets = MagicMock(return_value={log_path})
-    monkeypatch.setattr(ScalyrAgent, '_get_current_log_paths', current_targets)
-
     agent = ScalyrAgent({
         'cluster_id': CLUSTER_ID,
     })
@@ -314,20 +430,59 @@ def test_add_log_target_no_change(monkeypatch, scalyr_env, fx_scalyr):
 
     mock_open, mock_fp = patch_open(monkeypatch)
 
-    # assuming not the first run
-    agent._first_run = False
-    agent.api_key = SCALYR_KEY
-    mock_fp.read.side_effect = lambda: SCALYR_KEY
-
     with agent:
         agent.add_log_target(target)
 
-    makedirs.assert_called_with(os.path.dirname(log_path))
+    makedirs.assert_called_with(os.path.dirname(log_path), exist_ok=True)
     symlink.assert_called_with(target['kwargs']['log_file_path'], log_path)
 
-    mock_fp.write.assert_not_called()
+    mock_fp.write.assert_called_once()
+    assert agent.first_run is False
+
+    # targets did not change
+    with agent:
+        pass
+
+    mock_fp.write.assert_called_once()
+
+    # attributes changed
+    changed_target = copy.deepcopy(target)
+    changed_target['kwargs']['release'] = '2017'
+    with agent:
+        agent.add_log_target(changed_target)
+
+    assert mock_fp.write.call_count == 2
+
+
+def test_flush_config_up_to_date(monkeypatch, scalyr_env, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(config_path))
+
+    patch_os(monkeypatch)
+
+    isdir = MagicMock(return_value=True)
+    monkeypatch.setattr('os.path.isdir', isdir)
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+    with agent:
+        pass
+
+    config = config_path.read_text()
+    assert json.loads(config)['api_key'] == SCALYR_KEY
+    os.utime(str(config_path), ns=(0, 0))
+
+    # Restarted agent renders the same config
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+    with agent:
+        pass
 
     assert agent.first_run is False
+    assert config_path.read_text() == config
+    assert os.stat(str(config_path)).st_mtime_ns == 0
 
 
 def test_flush_failure(monkeypatch, scalyr_env, fx_scalyr):
@@ -345,13 +500,10 @@ def test_flush_failure(monkeypatch, scalyr_env, fx_scalyr):
     exists = MagicMock(side_effect=[True, False, False, True])
     monkeypatch.setattr('os.path.exists', exists)
 
-    makedirs, symlink, listdir = patch_os(monkeypatch)
+    makedirs, symlink, scandir = patch_os(monkeypatch)
 
     log_path = kwargs['logs'][0]['path']
 
-    current_targets = MagicMock(return_value=set())
-    monkeypatch.setattr(ScalyrAgent, '_get_current_log_paths', current_targets)
-
     agent = ScalyrAgent({
         'cluster_id': CLUSTER_ID,
     })
@@ -363,32 +515,16 @@ def test_flush_failure(monkeypatch, scalyr_env, fx_scalyr):
     with agent:
         agent.add_log_target(target)
 
-    makedirs.assert_called_with(os.path.dirname(log_path))
+    makedirs.assert_called_with(os.path.dirname(log_path), exist_ok=True)
     symlink.assert_called_with(target['kwargs']['log_file_path'], log_path)
 
     assert agent.first_run is False
 
 
-@pytest.mark.parametrize(
-    'config,result',
-    (
-        (
-            {'scalyr_api_key': '123', 'logs': [{'path': '/p1'}, {'path': '/p2'}, {'path': '/p3'}]},
-            {'/p1', '/p2', '/p3'}
-        ),
-        (
-            OSError,
-            set()
-        )
-    )
-)
-def test_get_current_log_paths(monkeypatch, scalyr_key_file, config, result):
+@pytest.mark.parametrize('exc', (None, OSError))
+def test_remove_log_target(monkeypatch, scalyr_key_file, exc):
     patch_env(monkeypatch, scalyr_key_file, ENVS[0])
-
-    mock_open, mock_fp = patch_open(monkeypatch)
-
-    load = MagicMock(side_effect=[config])
-    monkeypatch.setattr('json.load', load)
+    patch_os(monkeypatch)
 
     isdir = MagicMock(side_effect=[True, True])
     monkeypatch.setattr('os.path.isdir', isdir)
@@ -396,10 +532,10 @@ def test_get_current_log_paths(monkeypatch, scalyr_key_file, config, result):
     exists = MagicMock(side_effect=[True, False, False, True])
     monkeypatch.setattr('os.path.exists', exists)
 
-    get_template = MagicMock()
-    monkeypatch.setattr(env, 'get_template', get_template)
-
-    makedirs, symlink, listdir = patch_os(monkeypatch)
+    rmtree = MagicMock()
+    if exc:
+        rmtree.side_effect = exc
+    monkeypatch.setattr('shutil.rmtree', rmtree)
 
     agent = ScalyrAgent({
         'cluster_id': CLUSTER_ID,
@@ -407,39 +543,200 @@ def test_get_current_log_paths(monkeypatch, scalyr_key_file, config, result):
 
     assert_agent(agent)
 
-    res = agent._get_current_log_paths()
+    container_id = 'container-1'
+    agent._log_fragments[container_id] = '{}'
+    agent.remove_log_target(container_id)
 
-    assert res == result
+    assert container_id not in agent._log_fragments
+    rmtree.assert_not_called()
 
-    mock_open.assert_called_with(os.path.join(agent.config_path))
+    # Container directories are removed on flush
+    agent._remove_container_dirs()
+    rmtree.assert_called_once_with(os.path.join(agent.dest_path, container_id))
 
+    agent._remove_container_dirs()
+    rmtree.assert_called_once()
 
-@pytest.mark.parametrize('exc', (None, OSError))
-def test_remove_log_target(monkeypatch, scalyr_key_file, exc):
-    patch_env(monkeypatch, scalyr_key_file, ENVS[0])
+
+def test_flush_use_template(monkeypatch, scalyr_env, tmp_path):
+    monkeypatch.setenv('WATCHER_SCALYR_SERVER', 'https://upload.eu.scalyr.com')
+    isdir = MagicMock(return_value=True)
+    monkeypatch.setattr('os.path.isdir', isdir)
+    exists = MagicMock(return_value=True)
+    monkeypatch.setattr('os.path.exists', exists)
     patch_os(monkeypatch)
 
-    isdir = MagicMock(side_effect=[True, True])
+    configs = []
+    for use_template in ('true', 'false'):
+        config_path = tmp_path / 'agent-{}.json'.format(use_template)
+        monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(config_path))
+        monkeypatch.setenv('WATCHER_SCALYR_USE_TEMPLATE', use_template)
+
+        agent = ScalyrAgent({
+            'cluster_id': CLUSTER_ID,
+        })
+        assert agent.use_template is (use_template == 'true')
+
+        with agent:
+            agent.add_log_target(TARGET)
+
+        configs.append(json.loads(config_path.read_text()))
+
+    assert configs[0] == configs[1]
+    assert len(configs[0]['logs']) == 1
+
+
+def test_flush_api_key_file(monkeypatch, scalyr_env, scalyr_key_file, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(config_path))
+
+    patch_os(monkeypatch)
+
+    isdir = MagicMock(return_value=True)
     monkeypatch.setattr('os.path.isdir', isdir)
 
-    exists = MagicMock(side_effect=[True, False, False, True])
-    monkeypatch.setattr('os.path.exists', exists)
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
 
-    rmtree = MagicMock()
-    if exc:
-        rmtree.side_effect = exc
-    monkeypatch.setattr('shutil.rmtree', rmtree)
+    mock_open = MagicMock(wraps=open)
+    monkeypatch.setattr('builtins.open', mock_open)
+
+    with agent:
+        pass
+    assert agent.api_key == SCALYR_KEY
+
+    with agent:
+        pass
+    # Key file is read only once
+    assert [c for c in mock_open.call_args_list if c[0][0] == scalyr_key_file] == [call(scalyr_key_file)]
+
+    # Rotated key
+    with open(scalyr_key_file, 'w') as f:
+        f.write('scalyr-key-456')
+    os.utime(scalyr_key_file, ns=(0, 0))
+
+    with agent:
+        pass
+    assert agent.api_key == 'scalyr-key-456'
+    assert json.loads(config_path.read_text())['api_key'] == 'scalyr-key-456'
+
+
+def test_flush_idle(monkeypatch, scalyr_env, scalyr_key_file, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(config_path))
+
+    patch_os(monkeypatch)
+
+    monkeypatch.setattr('os.path.isdir', MagicMock(return_value=True))
+    monkeypatch.setattr('os.path.exists', MagicMock(return_value=True))
 
     agent = ScalyrAgent({
         'cluster_id': CLUSTER_ID,
     })
+    render_config = MagicMock(wraps=agent._render_config)
+    monkeypatch.setattr(agent, '_render_config', render_config)
 
-    assert_agent(agent)
+    with agent:
+        agent.add_log_target(TARGET_NO_ANNOT)
+    assert render_config.call_count == 1
 
-    container_id = 'container-1'
-    agent.remove_log_target(container_id)
+    # Nothing changed, config is not rendered again
+    with agent:
+        pass
+    assert render_config.call_count == 1
+
+    with agent:
+        agent.remove_log_target(TARGET_NO_ANNOT['id'])
+    assert render_config.call_count == 2
+    assert json.loads(config_path.read_text())['logs'] == []
 
-    rmtree.assert_called_with(os.path.join(agent.dest_path, container_id))
+    # Rotated key
+    with open(scalyr_key_file, 'w') as f:
+        f.write('scalyr-key-456')
+    os.utime(scalyr_key_file, ns=(0, 0))
+
+    with agent:
+        pass
+    assert render_config.call_count == 3
+    assert json.loads(config_path.read_text())['api_key'] == 'scalyr-key-456'
+
+
+def test_flush_idle_restores_config(monkeypatch, scalyr_env, scalyr_key_file, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(config_path))
+
+    patch_os(monkeypatch)
+
+    monkeypatch.setattr('os.path.isdir', MagicMock(return_value=True))
+    monkeypatch.setattr('os.path.exists', MagicMock(return_value=True))
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    with agent:
+        agent.add_log_target(TARGET_NO_ANNOT)
+    config = config_path.read_text()
+
+    # Removed
+    config_path.unlink()
+    with agent:
+        pass
+    assert config_path.read_text() == config
+
+    # Truncated
+    config_path.write_text('')
+    with agent:
+        pass
+    assert config_path.read_text() == config
+
+    # Overwritten with same size
+    config_path.write_text('x' * len(config))
+    os.utime(str(config_path), ns=(0, 0))
+    with agent:
+        pass
+    assert config_path.read_text() == config
+
+
+def test_flush_removes_container_dirs(monkeypatch, scalyr_env, tmp_path):
+    monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(tmp_path / 'agent.json'))
+    dest_path = tmp_path / 'watcher'
+    dest_path.mkdir()
+    monkeypatch.setenv('WATCHER_SCALYR_DEST_PATH', str(dest_path))
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    container_ids = ['container-{}'.format(i) for i in range(10)]
+    for container_id in container_ids:
+        (dest_path / container_id).mkdir()
+        (dest_path / container_id / 'app-v1.log').symlink_to(tmp_path / 'missing.log')
+
+    with agent:
+        for container_id in container_ids:
+            agent.remove_log_target(container_id)
+
+    assert os.listdir(str(dest_path)) == []
+
+
+def test_flush_remove_container_dirs_failure(monkeypatch, scalyr_env, tmp_path):
+    monkeypatch.setenv('WATCHER_SCALYR_CONFIG_PATH', str(tmp_path / 'agent.json'))
+    dest_path = tmp_path / 'watcher'
+    dest_path.mkdir()
+    monkeypatch.setenv('WATCHER_SCALYR_DEST_PATH', str(dest_path))
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+    })
+
+    monkeypatch.setattr('shutil.rmtree', MagicMock(side_effect=[OSError, RuntimeError]))
+
+    with pytest.raises(RuntimeError):
+        with agent:
+            agent.remove_log_target('container-1')
+            agent.remove_log_target('container-2')
 
 
 SERVER_ATTRIBUTES = {
@@ -453,334 +750,391 @@ SERVER_ATTRIBUTES = {
                 }
 
 
-@pytest.mark.parametrize(
-    'kwargs,expected',
+CONFIG_CASES = (
     (
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'monitor_journald': None,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'logs': []
-            },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'logs': [], 'monitors': [], 'journald_logs': [],
-            },
-        ),
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'logs': [],
-                'monitor_journald': {
-                    'journal_path': None, 'attributes': {}, 'extra_fields': {}, 'write_rate': 10000,
-                    'write_burst': 200000
-                },
+        {
+            'scalyr_key': SCALYR_KEY,
+            'monitor_journald': None,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'logs': []
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'logs': [], 'monitors': [], 'journald_logs': [],
+        },
+    ),
+    (
+        {
+            'scalyr_key': SCALYR_KEY,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'logs': [],
+            'monitor_journald': {
+                'journal_path': None, 'attributes': {}, 'extra_fields': {}, 'write_rate': 10000,
+                'write_burst': 200000
             },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'logs': [],
-                'monitors': [
-                    {
-                        'module': 'scalyr_agent.builtin_monitors.journald_monitor',
-                        'monitor_log_write_rate': 10000,
-                        'monitor_log_max_write_burst': 200000,
-                    }
-                ],
-                'journald_logs': [{'journald_unit': '.*', 'parser': 'journald_monitor'}],
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'logs': [],
+            'monitors': [
+                {
+                    'module': 'scalyr_agent.builtin_monitors.journald_monitor',
+                    'monitor_log_write_rate': 10000,
+                    'monitor_log_max_write_burst': 200000,
+                }
+            ],
+            'journald_logs': [{'journald_unit': '.*', 'parser': 'journald_monitor'}],
+        },
+    ),
+    (
+        {
+            'scalyr_key': SCALYR_KEY,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'logs': [
+                {
+                    'path': '/p1',
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'copy_from_start': True
+                }
+            ],
+            'monitor_journald': {
+                'journal_path': '/var/log/journal',
+                # 'extra_fields': {'_COMM': 'command'},
+                'write_rate': 10000,
+                'write_burst': 200000,
             },
-        ),
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'logs': [
-                    {
-                        'path': '/p1',
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'copy_from_start': True
-                    }
-                ],
-                'monitor_journald': {
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'logs': [
+                {
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'path': '/p1',
+                    'rename_logfile': '?application=&component=&version=&container_id=',
+                    'copy_from_start': True
+                }
+            ],
+            'monitors': [
+                {
+                    'module': 'scalyr_agent.builtin_monitors.journald_monitor',
+                    'monitor_log_write_rate': 10000,
+                    'monitor_log_max_write_burst': 200000,
                     'journal_path': '/var/log/journal',
-                    # 'extra_fields': {'_COMM': 'command'},
-                    'write_rate': 10000,
-                    'write_burst': 200000,
-                },
-            },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'logs': [
-                    {
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'path': '/p1',
-                        'rename_logfile': '?application=&component=&version=&container_id=',
-                        'copy_from_start': True
-                    }
-                ],
-                'monitors': [
-                    {
-                        'module': 'scalyr_agent.builtin_monitors.journald_monitor',
-                        'monitor_log_write_rate': 10000,
-                        'monitor_log_max_write_burst': 200000,
-                        'journal_path': '/var/log/journal',
-                        # 'extra_fields': {'_COMM': 'command'}
-                    }
-                ],
-                'journald_logs': [{'journald_unit': '.*', 'parser': 'journald_monitor'}],
-            },
-        ),
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'monitor_journald': None,
-                'logs': [
-                    {
-                        'path': '/p1',
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'copy_from_start': True,
-                        'sampling_rules': {"match_expression": "match-expression"}
-                    }
-                ]
-            },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'monitors': [],
-                'logs': [
-                    {
-                        'path': '/p1',
-                        'rename_logfile': '?application=&component=&version=&container_id=',
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'copy_from_start': True,
-                        'sampling_rules': {'match_expression': 'match-expression'}
-                    }
-                ],
-                'journald_logs': [],
-            },
-        ),
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'monitor_journald': None,
-                'logs': [
-                    {
-                        'path': '/p1',
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'copy_from_start': True,
-                        'redaction_rules': {'match_expression': 'match-expression'}
-                    }
-                ]
-            },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'monitors': [],
-                'logs': [
-                    {
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'path': '/p1',
-                        'rename_logfile': '?application=&component=&version=&container_id=',
-                        'copy_from_start': True,
-                        'redaction_rules': {'match_expression': 'match-expression'}
-                    }
-                ],
-                'journald_logs': [],
-            },
-        ),
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'enable_profiling': False,
-                'monitor_journald': None,
-                'logs': [
-                    {
-                        'path': '/p1',
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'copy_from_start': True,
-                        'redaction_rules': {'match_expression': 'match-expression'},
-                        'parse_lines_as_json': True,
-                    }
-                ]
-            },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'monitors': [],
-                'logs': [
-                    {
-                        'attributes': {'a1': 'v1', 'parser': 'c-parser'},
-                        'path': '/p1',
-                        'rename_logfile': '?application=&component=&version=&container_id=',
-                        'parse_lines_as_json': True,
-                        'copy_from_start': True,
-                        'redaction_rules': {'match_expression': 'match-expression'}
-                    }
-                ],
-                'journald_logs': [],
-            },
-        ),
-        (
-            {
-                'scalyr_key': SCALYR_KEY,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'enable_profiling': True,
-                'monitor_journald': None,
-                'logs': [
-                    {
-                        'path': '/p1',
-                        'attributes': {
-                            'a1': 'v1',
-                            'parser': 'c-parser',
-                            'application': APPLICATION,
-                            'component': COMPONENT,
-                            'version': VERSION,
-                            'container_id': CONTAINER_ID,
-                        },
-                        'copy_from_start': True,
-                        'redaction_rules': {'match_expression': 'match-expression'},
-                        'parse_lines_as_json': True,
-                    }
-                ],
-            },
-            {
-                'api_key': 'scalyr-key-123',
-                'max_log_offset_size': 536870912,
-                'max_existing_log_offset_size': 536870912,
-                'max_allowed_request_size': 5500000,
-                'min_request_spacing_interval': 0.5,
-                'max_request_spacing_interval': 1.0,
-                'pipeline_threshold': 0.1,
-                "compression_type": "deflate",
-                'enable_profiling': True,
-                "compression_level": 6,
-                "max_line_size": 49900,
-                "read_page_size": 131072,
-                'implicit_metric_monitor': False,
-                'implicit_agent_process_metrics_monitor': False,
-                "include_raw_timestamp_field": False,
-                'server_attributes': SERVER_ATTRIBUTES,
-                'monitors': [],
-                'logs': [
-                    {
-                        'attributes': {
-                            'a1': 'v1',
-                            'parser': 'c-parser',
-                            'application': APPLICATION,
-                            'component': COMPONENT,
-                            'version': VERSION,
-                            'container_id': CONTAINER_ID,
-                        },
-                        'path': '/p1',
-                        'rename_logfile': '?application={}&component={}&version={}&container_id={}'.format(
-                            quote_plus(APPLICATION),
-                            quote_plus(COMPONENT),
-                            quote_plus(VERSION),
-                            quote_plus(CONTAINER_ID),
-                        ),
-                        'parse_lines_as_json': True,
-                        'copy_from_start': True,
-                        'redaction_rules': {'match_expression': 'match-expression'}
-                    }
-                ],
-                'journald_logs': [],
-            },
-        ),
-    )
+                    # 'extra_fields': {'_COMM': 'command'}
+                }
+            ],
+            'journald_logs': [{'journald_unit': '.*', 'parser': 'journald_monitor'}],
+        },
+    ),
+    (
+        {
+            'scalyr_key': SCALYR_KEY,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'monitor_journald': None,
+            'logs': [
+                {
+                    'path': '/p1',
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'copy_from_start': True,
+                    'sampling_rules': {"match_expression": "match-expression"}
+                }
+            ]
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'monitors': [],
+            'logs': [
+                {
+                    'path': '/p1',
+                    'rename_logfile': '?application=&component=&version=&container_id=',
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'copy_from_start': True,
+                    'sampling_rules': {'match_expression': 'match-expression'}
+                }
+            ],
+            'journald_logs': [],
+        },
+    ),
+    (
+        {
+            'scalyr_key': SCALYR_KEY,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'monitor_journald': None,
+            'logs': [
+                {
+                    'path': '/p1',
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'copy_from_start': True,
+                    'redaction_rules': {'match_expression': 'match-expression'}
+                }
+            ]
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'monitors': [],
+            'logs': [
+                {
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'path': '/p1',
+                    'rename_logfile': '?application=&component=&version=&container_id=',
+                    'copy_from_start': True,
+                    'redaction_rules': {'match_expression': 'match-expression'}
+                }
+            ],
+            'journald_logs': [],
+        },
+    ),
+    (
+        {
+            'scalyr_key': SCALYR_KEY,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'enable_profiling': False,
+            'monitor_journald': None,
+            'logs': [
+                {
+                    'path': '/p1',
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'copy_from_start': True,
+                    'redaction_rules': {'match_expression': 'match-expression'},
+                    'parse_lines_as_json': True,
+                }
+            ]
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'monitors': [],
+            'logs': [
+                {
+                    'attributes': {'a1': 'v1', 'parser': 'c-parser'},
+                    'path': '/p1',
+                    'rename_logfile': '?application=&component=&version=&container_id=',
+                    'parse_lines_as_json': True,
+                    'copy_from_start': True,
+                    'redaction_rules': {'match_expression': 'match-expression'}
+                }
+            ],
+            'journald_logs': [],
+        },
+    ),
+    (
+        {
+            'scalyr_key': SCALYR_KEY,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'enable_profiling': True,
+            'monitor_journald': None,
+            'logs': [
+                {
+                    'path': '/p1',
+                    'attributes': {
+                        'a1': 'v1',
+                        'parser': 'c-parser',
+                        'application': APPLICATION,
+                        'component': COMPONENT,
+                        'version': VERSION,
+                        'container_id': CONTAINER_ID,
+                    },
+                    'copy_from_start': True,
+                    'redaction_rules': {'match_expression': 'match-expression'},
+                    'parse_lines_as_json': True,
+                }
+            ],
+        },
+        {
+            'api_key': 'scalyr-key-123',
+            'max_log_offset_size': 536870912,
+            'max_existing_log_offset_size': 536870912,
+            'max_allowed_request_size': 5500000,
+            'min_request_spacing_interval': 0.5,
+            'max_request_spacing_interval': 1.0,
+            'pipeline_threshold': 0.1,
+            "compression_type": "deflate",
+            'enable_profiling': True,
+            "compression_level": 6,
+            "max_line_size": 49900,
+            "read_page_size": 131072,
+            'implicit_metric_monitor': False,
+            'implicit_agent_process_metrics_monitor': False,
+            "include_raw_timestamp_field": False,
+            'server_attributes': SERVER_ATTRIBUTES,
+            'monitors': [],
+            'logs': [
+                {
+                    'attributes': {
+                        'a1': 'v1',
+                        'parser': 'c-parser',
+                        'application': APPLICATION,
+                        'component': COMPONENT,
+                        'version': VERSION,
+                        'container_id': CONTAINER_ID,
+                    },
+                    'path': '/p1',
+                    'rename_logfile': '?application={}&component={}&version={}&container_id={}'.format(
+                        quote_plus(APPLICATION),
+                        quote_plus(COMPONENT),
+                        quote_plus(VERSION),
+                        quote_plus(CONTAINER_ID),
+                    ),
+                    'parse_lines_as_json': True,
+                    'copy_from_start': True,
+                    'redaction_rules': {'match_expression': 'match-expression'}
+                }
+            ],
+            'journald_logs': [],
+        },
+    ),
 )
+
+
+@pytest.mark.parametrize('kwargs,expected', CONFIG_CASES)
 def test_tpl_render(monkeypatch, kwargs, expected):
     tpl = load_template(TPL_NAME)
+    log_tpl = load_template(LOG_TPL_NAME)
 
-    config = tpl.render(**kwargs)
+    kwargs = dict(kwargs)
+    log_fragments = [log_tpl.render(log=log) for log in kwargs.pop('logs')]
+    config = tpl.render(log_fragments=log_fragments, **kwargs)
 
     assert json.loads(config) == expected
 
 
+@pytest.mark.parametrize('kwargs,expected', CONFIG_CASES)
+def test_build_agent_config(kwargs, expected):
+    agent_config = build_agent_config(
+        kwargs['scalyr_key'],
+        kwargs['server_attributes'],
+        journald=kwargs['monitor_journald'],
+        scalyr_server=kwargs.get('scalyr_server'),
+        enable_profiling=kwargs.get('enable_profiling', False),
+    )
+    log_fragments = [json.dumps(build_log_config(log_entry(log))) for log in kwargs['logs']]
+
+    config = dump_agent_config(agent_config, log_fragments)
+
+    assert json.loads(config) == expected
+
+
+@pytest.mark.parametrize('kwargs,expected', CONFIG_CASES)
+def test_build_agent_config_template_parity(kwargs, expected):
+    kwargs = dict(kwargs, scalyr_server='https://upload.eu.scalyr.com', logs=[
+        {
+            'path': '/p1',
+            'attributes': {'application': 'app 1', 'component': 'main', 'version': 'v1', 'container_id': 'c-1'},
+            'sampling_rules': [{'match_expression': 'DEBUG', 'sampling_rate': 0}],
+            'redaction_rules': [JWT_REDACTION_RULE],
+            'parse_lines_as_json': True,
+        },
+        {
+            'path': '/p2',
+            'attributes': {'application': 'app-2', 'parser': 'c-parser'},
+            'sampling_rules': None,
+            'redaction_rules': [],
+            'parse_lines_as_json': False,
+        },
+    ])
+    if kwargs['monitor_journald']:
+        kwargs['monitor_journald'] = dict(kwargs['monitor_journald'], attributes={'cluster': CLUSTER_ID, 'n': 1})
+
+    tpl = load_template(TPL_NAME)
+    log_tpl = load_template(LOG_TPL_NAME)
+    from_template = tpl.render(log_fragments=[log_tpl.render(log=log) for log in kwargs['logs']],
+                               **{k: v for k, v in kwargs.items() if k != 'logs'})
+
+    agent_config = build_agent_config(
+        kwargs['scalyr_key'],
+        kwargs['server_attributes'],
+        journald=kwargs['monitor_journald'],
+        scalyr_server=kwargs['scalyr_server'],
+        enable_profiling=kwargs.get('enable_profiling', False),
+    )
+    config = dump_agent_config(agent_config, [json.dumps(build_log_config(log_entry(log))) for log in kwargs['logs']])
+
+    assert json.loads(config) == json.loads(from_template)
+
+
 def test_container_annotation_no_annotation():
     assert container_annotation(
         annotations={},
@@ -826,6 +1180,25 @@ def test_container_annotation_other_container():
     ) == "def"
 
 
+def test_container_annotation_first_match():
+    assert container_annotation(
+        annotations={
+            "foo": json.dumps(
+                ["not a container entry",
+                 {"container": "cnt",
+                  "bar": "first"},
+                 {"container": "cnt",
+                  "bar": "second"}]
+            )
+        },
+        container_name="cnt",
+        pod_name="pod",
+        annotation_key="foo",
+        result_key="bar",
+        default="def",
+    ) == "first"
+
+
 def test_container_annotation_not_a_list():
     assert container_annotation(
         annotations={
@@ -842,6 +1215,32 @@ def test_container_annotation_not_a_list():
     ) == "def"
 
 
+def test_container_annotation_not_a_list_warning(caplog):
+    container_annotation(
+        annotations={"foo": json.dumps({"container": "cnt", "bar": "baz"})},
+        container_name="cnt",
+        pod_name="pod",
+        annotation_key="foo",
+        result_key="bar",
+    )
+
+    assert caplog.messages == [
+        "Scalyr watcher agent found invalid foo annotation in pod: pod. Expected `list` found: `<class 'dict'>`"]
+
+
+def test_container_annotation_not_a_list_warning_percent(caplog):
+    container_annotation(
+        annotations={"foo%s": json.dumps({"container": "cnt", "bar": "baz"})},
+        container_name="cnt",
+        pod_name="pod%d",
+        annotation_key="foo%s",
+        result_key="bar",
+    )
+
+    assert caplog.messages == [
+        "Scalyr watcher agent found invalid foo%s annotation in pod: pod%d. Expected `list` found: `<class 'dict'>`"]
+
+
 def test_container_annotation_invalid_json():
     assert container_annotation(
         annotations={
@@ -855,6 +1254,28 @@ def test_container_annotation_invalid_json():
     ) == "def"
 
 
+def test_container_annotation_decoded_once(monkeypatch):
+    annotations = {
+        "foo": json.dumps(
+            [{"container": "cnt-1", "bar": "first"},
+             {"container": "cnt-2", "bar": "second"}]
+        )
+    }
+    loads = MagicMock(side_effect=json.loads)
+    monkeypatch.setattr('kube_log_watcher.jsonutils.loads', loads)
+
+    for container_name, expected in (('cnt-1', 'first'), ('cnt-2', 'second'), ('cnt-1', 'first')):
+        assert container_annotation(
+            annotations=annotations,
+            container_name=container_name,
+            pod_name="pod",
+            annotation_key="foo",
+            result_key="bar",
+        ) == expected
+
+    loads.assert_called_once_with(annotations["foo"])
+
+
 @pytest.fixture
 def minimal_kwargs():
     return {'pod_name': 'some-random-pod',
@@ -901,7 +1322,30 @@ def test_redaction_rules_custom(minimal_kwargs):
     assert get_redaction_rules(annotations, minimal_kwargs) == [custom_rule, JWT_REDACTION_RULE]
 
 
-def test_redaction_rules_invalid_format(minimal_kwargs):
+def test_redaction_rules_custom_jwt(minimal_kwargs):
+    custom_rule = {"match_expression": "foo", "replacement": "bar"}
+    jwt_rule = {"match_expression": JWT_REDACTION_RULE["match_expression"], "replacement": "<JWT>"}
+    annotations = {
+        "kubernetes-log-watcher/scalyr-redaction-rules": json.dumps(
+            [{"container": "cnt", "redaction-rules": [custom_rule, jwt_rule]}]
+        )
+    }
+    assert get_redaction_rules(annotations, minimal_kwargs) == [custom_rule, jwt_rule]
+
+
+def test_redaction_rules_shared_jwt_rule(minimal_kwargs):
+    first = get_redaction_rules({}, minimal_kwargs)
+    second = get_redaction_rules({}, minimal_kwargs)
+
+    assert first is not second
+    assert first[-1] is second[-1] is JWT_REDACTION_RULE
+    assert JWT_REDACTION_RULE == {
+        "match_expression": "eyJ[a-zA-Z0-9/+_=-]{5,}\\.eyJ[a-zA-Z0-9/+_=-]{5,}\\.[a-zA-Z0-9/+_=-]{5,}",
+        "replacement": "+++JWT_TOKEN_REDACTED+++"
+    }
+
+
+def test_redaction_rules_invalid_format(minimal_kwargs, caplog):
     custom_rule = {"match_expression": "foo", "replacement": "bar"}
     annotations = {
         "kubernetes-log-watcher/scalyr-redaction-rules": json.dumps(
@@ -909,6 +1353,9 @@ def test_redaction_rules_invalid_format(minimal_kwargs):
         )
     }
     assert get_redaction_rules(annotations, minimal_kwargs) == [JWT_REDACTION_RULE]
+    assert caplog.messages == [
+        'Scalyr watcher agent found invalid redaction rule annotation in pod/container: some-random-pod/cnt. '
+        "Expected `list` found: `<class 'dict'>`"]
 
 
 def test_parse_scalyr_sampling_rules(monkeypatch, scalyr_env, fx_scalyr):
@@ -1000,6 +1447,77 @@ def test_get_scalyr_sampling_rule(monkeypatch, scalyr_env, fx_scalyr):
     assert rule == '{"annotation": 8}'
 
 
+def test_get_scalyr_sampling_rule_single_crc(monkeypatch, scalyr_env):
+    patch_os(monkeypatch)
+
+    isdir = MagicMock(side_effect=[True, True])
+    monkeypatch.setattr('os.path.isdir', isdir)
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+        'scalyr_sampling_rules': SCALYR_SAMPLING_RULES,
+    })
+
+    crc32 = MagicMock(return_value=42)
+    monkeypatch.setattr('binascii.crc32', crc32)
+
+    container_data = {
+        'application': 'app-1',
+        'component': 'comp-1',
+        'container_id': 'container-1',
+    }
+
+    # Two probability rules are checked, the container sample is computed once
+    assert agent.get_scalyr_sampling_rule(container_data) == '{"annotation": 2}'
+    crc32.assert_called_once_with(b'container-1')
+
+
+def test_add_log_target_with_sampling_shared_annotations(monkeypatch, scalyr_env):
+    patch_os(monkeypatch)
+
+    monkeypatch.setattr('os.path.isdir', MagicMock(return_value=True))
+    monkeypatch.setattr('os.path.exists', MagicMock(return_value=True))
+
+    def rules(match_expression):
+        return [
+            {'container': c, 'sampling-rules': [{'match_expression': match_expression, 'sampling_rate': 0}]}
+            for c in ('cont-1', 'cont-2')
+        ]
+
+    agent = ScalyrAgent({
+        'cluster_id': CLUSTER_ID,
+        'scalyr_sampling_rules': [
+            {'application': 'app-1', 'component': 'main', 'probability': 0.5, 'value': json.dumps(rules('OVR'))},
+        ],
+    })
+
+    # Containers of the same pod share the pod annotations dict
+    pod_annotations = {SCALYR_ANNOTATION_SAMPLING_RULES: json.dumps(rules('ORIG'))}
+    pod_annotations_before = copy.deepcopy(pod_annotations)
+
+    targets = []
+    for name, container_id in (
+        # Sampled
+        ('cont-1', '472de5194b88bc3302721ac28dcfe3a9fdc58350d0a8dcafab2f24683bca50f8'),
+        # Not sampled
+        ('cont-2', 'f2c88e81c4a4dd91023e5725bae3f743caef6e6bd727e255c7c6949a8bf56978'),
+    ):
+        target = copy.deepcopy(TARGET_NO_ANNOT)
+        target['id'] = target['kwargs']['container_id'] = container_id
+        target['kwargs']['container_name'] = name
+        target['kwargs']['pod_annotations'] = pod_annotations
+        targets.append(target)
+
+    for target in targets:
+        agent.add_log_target(target)
+
+    sampled, not_sampled = (agent.logs[target['id']].sampling_rules for target in targets)
+
+    assert sampled == [{'match_expression': 'OVR', 'sampling_rate': 0}]
+    assert not_sampled == [{'match_expression': 'ORIG', 'sampling_rate': 0}]
+    assert pod_annotations == pod_annotations_before
+
+
 def test_add_log_target_with_sampling(monkeypatch, scalyr_env, fx_scalyr):
     target = fx_scalyr['target']
 
@@ -1033,4 +1551,4 @@ def test_add_log_target_with_sampling(monkeypatch, scalyr_env, fx_scalyr):
 
     agent.add_log_target(target)
 
-    assert agent.logs[target['id']]['sampling_rules'] == [{'match_expression': 'INFO', 'sampling_rate': 0}]
+    assert agent.logs[target['id']].sampling_rules == [{'match_expression': 'INFO', 'sampling_rate': 0}]